@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
 from future.builtins import bytes, open
 
+import json
+from contextlib import closing
 from csv import writer
+from itertools import islice
 from mimetypes import guess_type
-from os.path import join
-from datetime import datetime
-from io import BytesIO, StringIO
+from os.path import basename, getsize
+from datetime import date, datetime
+from io import BytesIO
+from tempfile import TemporaryFile
 
 from django.contrib import admin
 from django.core.files.storage import FileSystemStorage
@@ -15,16 +19,27 @@ except ImportError:
     # For django 1.8 compatiblity
     from django.conf.urls import url as re_path
     from django.core.urlresolvers import reverse
-from django.db.models import Count
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import FileResponse, Http404, HttpResponse
+from django.http import HttpResponseRedirect
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.encoding import iri_to_uri
 from django.utils.translation import ungettext, ugettext_lazy as _
 
+from forms_builder.forms import fields
 from forms_builder.forms.forms import EntriesForm
+from forms_builder.forms.metrics import timed, timed_iterator
 from forms_builder.forms.models import Form, Field, FormEntry, FieldEntry
+from forms_builder.forms.models import EntryDeletion, QueuedEmail
+from forms_builder.forms.models import DELETION_STATUS_PENDING
+from forms_builder.forms.models import DELETION_STATUS_RUNNING
 from forms_builder.forms.settings import CSV_DELIMITER, UPLOAD_ROOT
+from forms_builder.forms.settings import DELETE_IN_BACKGROUND
+from forms_builder.forms.settings import ENTRIES_PER_PAGE
+from forms_builder.forms.settings import SENDFILE_HEADER, SENDFILE_URL
 from forms_builder.forms.settings import USE_SITES, EDITABLE_SLUGS
-from forms_builder.forms.utils import now, slugify
+from forms_builder.forms.utils import now, parse_range, slugify
 
 try:
     import xlwt
@@ -33,13 +48,19 @@ try:
 except ImportError:
     XLWT_INSTALLED = False
 
+try:
+    import xlsxwriter
+    XLSXWRITER_INSTALLED = True
+except ImportError:
+    XLSXWRITER_INSTALLED = False
+
 
 fs = FileSystemStorage(location=UPLOAD_ROOT)
 form_admin_filter_horizontal = ()
 form_admin_fieldsets = [
     (None, {"fields": ("title", ("status", "login_required",),
-        ("publish_date", "expiry_date",),
-        "intro", "button_text", "response", "redirect_url")}),
+        ("publish_date", "expiry_date",), "max_entries", "retention_days",
+        "throttle_rate", "intro", "button_text", "response", "redirect_url")}),
     (_("Email"), {"fields": ("send_email", "email_from", "email_copies",
         "email_subject", "email_message")}),]
 
@@ -53,6 +74,102 @@ if USE_SITES:
     form_admin_filter_horizontal = ("sites",)
 
 
+class Echo(object):
+    """
+    File-like object that returns what's written to it, for passing
+    each line built by a CSV writer straight back to the caller.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(entries_form):
+    """
+    Generator of CSV lines for the columns and rows of the given
+    ``EntriesForm``, for streaming exports without holding the whole
+    file in memory.
+    """
+    try:
+        csv = writer(Echo(), delimiter=CSV_DELIMITER)
+        writerow = csv.writerow
+    except TypeError:
+        delimiter = bytes(CSV_DELIMITER, encoding="utf-8")
+        csv = writer(Echo(), delimiter=delimiter)
+        writerow = lambda row: csv.writerow([c.encode("utf-8")
+            if hasattr(c, "encode") else c for c in row])
+    yield writerow(entries_form.columns())
+    for row in entries_form.rows(csv=True):
+        yield writerow(row)
+
+
+def xlsx_file(entries_form, title):
+    """
+    Write the columns and rows of the given ``EntriesForm`` to an XLSX
+    workbook in a temporary file, using xlsxwriter's constant memory
+    mode which writes each row out as it's added. Date values are
+    written as native date cells. Submitted values are always written
+    as text, rather than as formulas or links.
+    """
+    f = TemporaryFile()
+    workbook = xlsxwriter.Workbook(f, {"constant_memory": True,
+                                       "remove_timezone": True,
+                                       "strings_to_formulas": False,
+                                       "strings_to_urls": False})
+    date_format = workbook.add_format({"num_format": "yyyy-mm-dd"})
+    datetime_format = workbook.add_format({"num_format":
+                                           "yyyy-mm-dd hh:mm:ss"})
+    sheet = workbook.add_worksheet(title[:31])
+    # Store the parser for the columns of date fields.
+    parsers = {}
+    columns = [field for field in entries_form.form_fields
+               if entries_form.posted_data("field_%s_export" % field.id)]
+    for c, field in enumerate(columns):
+        if field.is_a(fields.DATE_TIME):
+            parsers[c] = parse_datetime
+        elif field.is_a(*fields.DATES):
+            parsers[c] = parse_date
+    for c, col in enumerate(entries_form.columns()):
+        sheet.write_string(0, c, col)
+    for r, row in enumerate(entries_form.rows(csv=True), 1):
+        for c, item in enumerate(row):
+            if c in parsers and item:
+                try:
+                    item = parsers[c](item) or item
+                except ValueError:
+                    pass
+            if isinstance(item, datetime):
+                sheet.write_datetime(r, c, item, datetime_format)
+            elif isinstance(item, date):
+                sheet.write_datetime(r, c, item, date_format)
+            else:
+                sheet.write(r, c, item)
+    workbook.close()
+    return f
+
+
+class FileRange(object):
+    """
+    File-like object that reads the given number of bytes from a file,
+    starting at the given position, for responding to range requests.
+    """
+
+    def __init__(self, f, start, length):
+        self.file = f
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
 class FieldAdmin(admin.TabularInline):
     model = Field
     exclude = ('slug', )
@@ -74,13 +191,13 @@ class FormAdmin(admin.ModelAdmin):
     radio_fields = {"status": admin.HORIZONTAL}
     fieldsets = form_admin_fieldsets
 
-    def get_queryset(self, request):
+    def delete_model(self, request, obj):
         """
-        Annotate the queryset with the entries count for use in the
-        admin list view.
+        Delete the form's entries in batches before the form, rather
+        than letting the form's deletion cascade to them all at once.
         """
-        qs = super(FormAdmin, self).get_queryset(request)
-        return qs.annotate(total_entries=Count("entries"))
+        self.formentry_model.objects.filter(form=obj).delete_in_batches()
+        super(FormAdmin, self).delete_model(request, obj)
 
     def get_urls(self):
         """
@@ -104,7 +221,7 @@ class FormAdmin(admin.ModelAdmin):
         return extra_urls + urls
 
     def entries_view(self, request, form_id, show=False, export=False,
-                     export_xls=False):
+                     export_xls=False, export_xlsx=False):
         """
         Displays the form entries in a HTML table with option to
         export as CSV file.
@@ -119,30 +236,20 @@ class FormAdmin(admin.ModelAdmin):
         entries_form = EntriesForm(*args)
         delete = "%s.delete_formentry" % self.formentry_model._meta.app_label
         can_delete_entries = request.user.has_perm(delete)
-        submitted = entries_form.is_valid() or show or export or export_xls
+        submitted = (entries_form.is_valid() or show or export or
+                     export_xls or export_xlsx)
         export = export or request.POST.get("export")
         export_xls = export_xls or request.POST.get("export_xls")
+        export_xlsx = export_xlsx or request.POST.get("export_xlsx")
         if submitted:
             if export:
-                response = HttpResponse(content_type="text/csv")
+                lines = timed_iterator("export_csv", form.id,
+                                       csv_lines(entries_form))
+                response = StreamingHttpResponse(lines,
+                                                 content_type="text/csv")
                 fname = "%s-%s.csv" % (form.slug, slugify(now().ctime()))
                 attachment = "attachment; filename=%s" % fname
                 response["Content-Disposition"] = attachment
-                queue = StringIO()
-                try:
-                    csv = writer(queue, delimiter=CSV_DELIMITER)
-                    writerow = csv.writerow
-                except TypeError:
-                    queue = BytesIO()
-                    delimiter = bytes(CSV_DELIMITER, encoding="utf-8")
-                    csv = writer(queue, delimiter=delimiter)
-                    writerow = lambda row: csv.writerow([c.encode("utf-8")
-                        if hasattr(c, "encode") else c for c in row])
-                writerow(entries_form.columns())
-                for row in entries_form.rows(csv=True):
-                    writerow(row)
-                data = queue.getvalue()
-                response.write(data)
                 return response
             elif XLWT_INSTALLED and export_xls:
                 response = HttpResponse(content_type="application/vnd.ms-excel")
@@ -150,33 +257,76 @@ class FormAdmin(admin.ModelAdmin):
                 attachment = "attachment; filename=%s" % fname
                 response["Content-Disposition"] = attachment
                 queue = BytesIO()
-                workbook = xlwt.Workbook(encoding='utf8')
-                sheet = workbook.add_sheet(form.title[:31])
-                for c, col in enumerate(entries_form.columns()):
-                    sheet.write(0, c, col)
-                for r, row in enumerate(entries_form.rows(csv=True)):
-                    for c, item in enumerate(row):
-                        if isinstance(item, datetime):
-                            item = item.replace(tzinfo=None)
-                            sheet.write(r + 2, c, item, XLWT_DATETIME_STYLE)
-                        else:
-                            sheet.write(r + 2, c, item)
-                workbook.save(queue)
+                with timed("export_xls", form.id):
+                    workbook = xlwt.Workbook(encoding='utf8')
+                    sheet = workbook.add_sheet(form.title[:31])
+                    for c, col in enumerate(entries_form.columns()):
+                        sheet.write(0, c, col)
+                    for r, row in enumerate(entries_form.rows(csv=True)):
+                        for c, item in enumerate(row):
+                            if isinstance(item, datetime):
+                                item = item.replace(tzinfo=None)
+                                sheet.write(r + 2, c, item,
+                                            XLWT_DATETIME_STYLE)
+                            else:
+                                sheet.write(r + 2, c, item)
+                    workbook.save(queue)
                 data = queue.getvalue()
                 response.write(data)
                 return response
+            elif XLSXWRITER_INSTALLED and export_xlsx:
+                with timed("export_xlsx", form.id):
+                    f = xlsx_file(entries_form, form.title)
+                size = f.tell()
+                f.seek(0)
+                content_type = ("application/vnd.openxmlformats-"
+                                "officedocument.spreadsheetml.sheet")
+                response = FileResponse(f, content_type=content_type)
+                fname = "%s-%s.xlsx" % (form.slug, slugify(now().ctime()))
+                attachment = "attachment; filename=%s" % fname
+                response["Content-Disposition"] = attachment
+                response["Content-Length"] = size
+                return response
             elif request.POST.get("delete") and can_delete_entries:
                 selected = request.POST.getlist("selected")
-                if selected:
+                select_all = request.POST.get("select_all")
+                if selected or select_all:
                     try:
                         from django.contrib.messages import info
                     except ImportError:
                         def info(request, message, fail_silently=True):
                             request.user.message_set.create(message=message)
-                    entries = self.formentry_model.objects.filter(id__in=selected)
-                    count = entries.count()
-                    if count > 0:
-                        entries.delete()
+                    background = False
+                    if select_all:
+                        # Every entry matching the filters, across pages.
+                        # Filters that can only be checked against each
+                        # row are left to the background job, when the
+                        # entries matching the others are too many to
+                        # delete during the request.
+                        entries, filters = entries_form.apply_filters(
+                            self.formentry_model.objects.filter(form=form))
+                        count = entries.count()
+                        background = (DELETE_IN_BACKGROUND is not None and
+                                      count > DELETE_IN_BACKGROUND)
+                        if filters and not background:
+                            entries = entries_form.entries()
+                            count = entries.count()
+                    else:
+                        entries = self.formentry_model.objects.filter(
+                            form=form, id__in=selected)
+                        count = entries.count()
+                    if background:
+                        EntryDeletion.objects.create(form=form, total=count,
+                            filters=json.dumps(entries_form.filter_data()))
+                        if filters:
+                            message = _("Up to %(count)s entries will be "
+                                        "deleted in the background")
+                        else:
+                            message = _("%(count)s entries will be deleted "
+                                        "in the background")
+                        info(request, message % {"count": count})
+                    elif count > 0:
+                        count = entries.delete_in_batches()
                         message = ungettext("1 entry deleted",
                                             "%(count)s entries deleted", count)
                         info(request, message % {"count": count})
@@ -184,23 +334,119 @@ class FormAdmin(admin.ModelAdmin):
         context = {"title": _("View Entries"), "entries_form": entries_form,
                    "opts": self.model._meta, "original": form,
                    "can_delete_entries": can_delete_entries,
+                   "deletions": EntryDeletion.objects.filter(form_id=form.id,
+                       status__in=(DELETION_STATUS_PENDING,
+                                   DELETION_STATUS_RUNNING)),
                    "submitted": submitted,
-                   "xlwt_installed": XLWT_INSTALLED}
+                   "xlwt_installed": XLWT_INSTALLED,
+                   "xlsxwriter_installed": XLSXWRITER_INSTALLED}
+        if submitted:
+            cursors = {}
+            for name in ("before", "after"):
+                try:
+                    cursors[name] = int(request.POST[name])
+                except (KeyError, ValueError):
+                    pass
+            context["page"] = self.entries_page(entries_form, **cursors)
         return render(request, template, context)
 
+    def entries_page(self, entries_form, before=None, after=None):
+        """
+        Returns a page of rows for the entries view, along with the
+        cursors for the next and previous pages. The cursors are the
+        IDs of the last and first entries on the page, so each page is
+        read from the entries past the cursor rather than from an
+        offset, and remains stable as entries are added or deleted.
+        """
+        # Close the rows once the page is read, rather than when they're
+        # garbage collected, so that their timing is reported now.
+        with closing(entries_form.rows(before=before, after=after)) as rows:
+            rows = list(islice(rows, ENTRIES_PER_PAGE + 1))
+        more = len(rows) > ENTRIES_PER_PAGE
+        rows = rows[:ENTRIES_PER_PAGE]
+        if after is not None:
+            if not more:
+                # Paged back to the start, so show the first page.
+                return self.entries_page(entries_form)
+            rows.reverse()
+            has_previous, has_next = True, True
+        else:
+            has_previous, has_next = before is not None, more
+        page = {"rows": rows, "previous": None, "next": None}
+        if rows and has_previous:
+            page["previous"] = rows[0][0]
+        if rows and has_next:
+            page["next"] = rows[-1][0]
+        return page
+
     def file_view(self, request, field_entry_id):
         """
-        Output the file for the requested field entry.
+        Output the file for the requested field entry. The file is
+        streamed rather than read into memory, and a single byte range
+        can be requested for resuming downloads. With the
+        ``FORMS_BUILDER_SENDFILE_HEADER`` setting defined, the transfer
+        is handed off to the web server instead.
         """
         model = self.fieldentry_model
         field_entry = get_object_or_404(model, id=field_entry_id)
-        path = join(fs.location, field_entry.value)
-        response = HttpResponse(content_type=guess_type(path)[0])
-        f = open(path, "r+b")
-        response["Content-Disposition"] = "attachment; filename=%s" % f.name
-        response.write(f.read())
-        f.close()
+        path = fs.path(field_entry.value)
+        content_type = guess_type(path)[0] or "application/octet-stream"
+        if SENDFILE_HEADER:
+            response = HttpResponse(content_type=content_type)
+            if SENDFILE_HEADER == "X-Accel-Redirect":
+                url = "%s/%s" % (SENDFILE_URL.rstrip("/"), field_entry.value)
+                response[SENDFILE_HEADER] = iri_to_uri(url)
+            else:
+                response[SENDFILE_HEADER] = path
+        else:
+            try:
+                size = getsize(path)
+            except OSError:
+                raise Http404
+            try:
+                byte_range = None
+                if "HTTP_IF_RANGE" not in request.META:
+                    header = request.META.get("HTTP_RANGE", "")
+                    byte_range = parse_range(header, size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = "bytes */%s" % size
+                return response
+            f = open(path, "rb")
+            if byte_range is None:
+                response = FileResponse(f, content_type=content_type)
+                response["Content-Length"] = size
+            else:
+                start, end = byte_range
+                f = FileRange(f, start, end - start + 1)
+                response = FileResponse(f, status=206,
+                                        content_type=content_type)
+                response["Content-Length"] = end - start + 1
+                response["Content-Range"] = "bytes %s-%s/%s" % (start, end,
+                                                                 size)
+            response["Accept-Ranges"] = "bytes"
+        attachment = "attachment; filename=%s" % basename(path)
+        response["Content-Disposition"] = attachment
         return response
 
 
+class QueuedEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "recipients", "status", "attempts",
+                    "next_attempt", "sent_time")
+    list_filter = ("status",)
+    search_fields = ("subject", "recipients")
+    readonly_fields = ("status", "attempts", "next_attempt", "sent_time",
+                       "last_error")
+
+
+class EntryDeletionAdmin(admin.ModelAdmin):
+    list_display = ("form", "status", "deleted", "total", "created",
+                    "finished")
+    list_filter = ("status",)
+    readonly_fields = ("form", "filters", "total", "deleted", "created",
+                       "finished", "last_error")
+
+
 admin.site.register(Form, FormAdmin)
+admin.site.register(QueuedEmail, QueuedEmailAdmin)
+admin.site.register(EntryDeletion, EntryDeletionAdmin)
@@ -0,0 +1,268 @@
+"""
+Benchmarks for building, submitting, listing and exporting forms, run
+against generated forms and entries by the ``benchmark_forms`` command.
+"""
+
+from __future__ import unicode_literals
+from future.builtins import range
+
+import platform
+from datetime import date, timedelta
+from timeit import default_timer
+
+import django
+from django.contrib import admin
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.template import Context, RequestContext, Template
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2 has no way to measure peak memory.
+    tracemalloc = None
+
+import forms_builder
+from forms_builder.forms import fields, settings
+from forms_builder.forms.admin import XLSXWRITER_INSTALLED, XLWT_INSTALLED
+from forms_builder.forms.forms import EntriesForm, FormForForm
+from forms_builder.forms.models import Form, FormEntry, FieldEntry
+from forms_builder.forms.models import STATUS_PUBLISHED
+from forms_builder.forms.utils import now
+
+
+# The field types that forms are generated with, in turn, along with
+# the choices and submitted value for each.
+FIELD_TYPES = (
+    (fields.TEXT, "", "Lorem ipsum dolor sit amet"),
+    (fields.EMAIL, "", "test@example.com"),
+    (fields.NUMBER, "", "42"),
+    (fields.SELECT, "red, green, blue", "green"),
+    (fields.CHECKBOX_MULTIPLE, "red, green, blue", ["red", "blue"]),
+    (fields.DATE, "", "2019-01-02"),
+    (fields.TEXTAREA, "", "Lorem ipsum dolor sit amet " * 10),
+)
+
+
+def create_published_form(title):
+    """
+    Create a form that's published on the current site.
+    """
+    form = Form.objects.create(title=title, status=STATUS_PUBLISHED)
+    if settings.USE_SITES:
+        form.sites.add(Site.objects.get_current())
+    return form
+
+
+def create_form(num_fields):
+    """
+    Create a published form with the given number of fields.
+    """
+    form = create_published_form("Benchmark %s" % num_fields)
+    for i in range(num_fields):
+        field_type, choices, _ = FIELD_TYPES[i % len(FIELD_TYPES)]
+        form.fields.create(label="Field %s" % i, field_type=field_type,
+                           choices=choices, required=False)
+    return Form.objects.get(id=form.id)
+
+
+def form_data(form):
+    """
+    Return data submitting a value for each of the form's fields.
+    """
+    values = dict((field_type, value) for field_type, _, value in FIELD_TYPES)
+    data = {}
+    for field in form.fields.all():
+        data[field.slug] = values[field.field_type]
+    return data
+
+
+def create_entries(form, num_entries):
+    """
+    Create the given number of entries for the form, with values as
+    ``FormForForm`` stores them, without submitting each one.
+    """
+    data = form_data(form)
+    form_for_form = FormForForm(form, Context(), data)
+    form_for_form.is_valid()
+    values = {}
+    for field in form.fields.all():
+        value = form_for_form.cleaned_data[field.slug]
+        if isinstance(value, list):
+            value = ", ".join(value)
+        values[field.id] = value
+    entry_time = now()
+    for i in range(num_entries):
+        entry = FormEntry(form=form, entry_time=entry_time)
+        entry.set_snapshot(values)
+        entry.save()
+        FieldEntry.objects.bulk_create([FieldEntry(entry=entry,
+            field_id=field_id, value=value) for field_id, value in
+            values.items()])
+        entry_time -= timedelta(minutes=1)
+    Form.objects.filter(id=form.id).update(entry_count=num_entries)
+
+
+def measure(func, repeat):
+    """
+    Call the function ``repeat`` times, returning the fastest time in
+    seconds, then once more measuring the queries run and the peak
+    memory allocated in bytes, which aren't measured while timing as
+    tracing memory slows everything down.
+    """
+    times = []
+    for i in range(repeat):
+        start = default_timer()
+        func()
+        times.append(default_timer() - start)
+    peak_memory = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    if tracemalloc is not None:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"time": min(times), "mean_time": sum(times) / len(times),
+            "peak_memory": peak_memory, "queries": len(queries)}
+
+
+def export_request(form, **extra):
+    """
+    Return a request for exporting all of the form's fields and
+    entries via the admin.
+    """
+    data = {"field_0_export": "on"}
+    for field in form.fields.all():
+        data["field_%s_export" % field.id] = "on"
+    data.update(extra)
+    request = RequestFactory().post("/", data)
+    request.user = User(is_active=True, is_staff=True, is_superuser=True)
+    return request
+
+
+def consume(response):
+    """
+    Read all of a response's content, streamed or not.
+    """
+    if response.streaming:
+        for chunk in response.streaming_content:
+            pass
+    else:
+        response.content
+
+
+def form_benchmarks(form):
+    """
+    Yields the name and function of each benchmark for a form without
+    entries.
+    """
+    data = form_data(form)
+    request = RequestFactory().get("/")
+    request.user = AnonymousUser()
+    template = Template("{% load forms_builder_tags %}"
+                        "{% render_built_form form %}")
+
+    def build():
+        FormForForm(form, Context())
+
+    def validate():
+        assert FormForForm(form, Context(), data).is_valid()
+
+    def save():
+        form_for_form = FormForForm(form, Context(), data)
+        form_for_form.is_valid()
+        form_for_form.save()
+
+    def render():
+        template.render(RequestContext(request, {"form": form}))
+
+    yield "build", build
+    yield "validate", validate
+    yield "save", save
+    yield "render_built_form", render
+
+
+def entries_benchmarks(form):
+    """
+    Yields the name and function of each benchmark for a form with
+    entries.
+    """
+    form_admin = admin.site._registry[Form]
+    request = export_request(form)
+
+    def rows():
+        entries_form = EntriesForm(form, request, data=request.POST)
+        entries_form.is_valid()
+        for row in entries_form.rows():
+            pass
+
+    def export(**kwargs):
+        def export_entries():
+            request = export_request(form, **kwargs)
+            consume(form_admin.entries_view(request, form.id))
+        return export_entries
+
+    yield "rows", rows
+    yield "export_csv", export(export="1")
+    if XLWT_INSTALLED:
+        yield "export_xls", export(export_xls="1")
+    if XLSXWRITER_INSTALLED:
+        yield "export_xlsx", export(export_xlsx="1")
+
+
+def run(field_counts, entry_counts, num_forms=100, repeat=5):
+    """
+    Run each benchmark for forms with each number of fields, and each
+    number of entries for those using entries, yielding a dict of the
+    measurements for each. The database should be empty, since forms
+    and entries are created as they're needed.
+    """
+    for i in range(num_forms):
+        create_published_form("Published %s" % i)
+    slug = Form.objects.latest("id").slug
+
+    def published():
+        list(Form.objects.published())
+
+    def get_published():
+        Form.objects.get_published(slug)
+
+    for name, func in (("published", published),
+                       ("get_published", get_published)):
+        result = {"name": name, "forms": num_forms}
+        result.update(measure(func, repeat))
+        yield result
+
+    for num_fields in field_counts:
+        form = create_form(num_fields)
+        for name, func in form_benchmarks(form):
+            result = {"name": name, "fields": num_fields}
+            result.update(measure(func, repeat))
+            yield result
+        form.delete()
+        for num_entries in entry_counts:
+            form = create_form(num_fields)
+            create_entries(form, num_entries)
+            for name, func in entries_benchmarks(form):
+                result = {"name": name, "fields": num_fields,
+                          "entries": num_entries}
+                result.update(measure(func, repeat))
+                yield result
+            form.delete()
+
+
+def environment():
+    """
+    Return the versions the benchmarks are run with, for comparing
+    results.
+    """
+    return {
+        "forms_builder": forms_builder.__version__,
+        "django": django.get_version(),
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "date": date.today().isoformat(),
+    }
@@ -1,7 +1,10 @@
 from __future__ import unicode_literals
 from future.builtins import int, range, str
 
-from datetime import date, datetime
+from collections import OrderedDict
+from copy import deepcopy
+from itertools import islice
+from datetime import date, datetime, timedelta
 from os.path import join, split
 from uuid import uuid4
 
@@ -12,7 +15,10 @@ try:
 except ImportError:
     # For Django 1.8 compatibility
     from django.forms.extras import SelectDateWidget
+from django.core.cache import caches
 from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Case, Value, When
 try:
     from django.urls import reverse
 except ImportError:
@@ -22,10 +28,11 @@ from django.template import Template
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
-from forms_builder.forms import fields
+from forms_builder.forms import fields, metrics
 from forms_builder.forms.models import FormEntry, FieldEntry
 from forms_builder.forms import settings
-from forms_builder.forms.utils import now, split_choices
+from forms_builder.forms.utils import LRUCache, is_template, now, split_choices
+from forms_builder.forms.utils import CSRF_TOKEN_MARKER, SUBMISSION_TOKEN_MARKER
 
 
 fs = default_storage
@@ -114,6 +121,18 @@ FILTER_FUNCS = {
         lambda val, field: set(val) != set(split_choices(field)),
 }
 
+# The lookups on field entry values for filter types that can be
+# applied by the database, and whether entries matching the lookup
+# are excluded, rather than included.
+FILTER_LOOKUPS = {
+    FILTER_CHOICE_CONTAINS: ("value__icontains", False),
+    FILTER_CHOICE_DOESNT_CONTAIN: ("value__icontains", True),
+    FILTER_CHOICE_EQUALS: ("value__iexact", False),
+    FILTER_CHOICE_DOESNT_EQUAL: ("value__iexact", True),
+    FILTER_CHOICE_CONTAINS_ANY: ("value__in", False),
+    FILTER_CHOICE_DOESNT_CONTAIN_ANY: ("value__in", True),
+}
+
 # Export form fields for each filter type grouping
 text_filter_field = forms.ChoiceField(label=" ", required=False,
                                       choices=TEXT_FILTER_CHOICES)
@@ -125,6 +144,127 @@ date_filter_field = forms.ChoiceField(label=" ", required=False,
                                       choices=DATE_FILTER_CHOICES)
 
 
+def build_field(field):
+    """
+    Build the form field instance for the given field model instance,
+    with its widget and identifying attributes set up.
+    """
+    field_class = fields.CLASSES[field.field_type]
+    field_widget = fields.WIDGETS.get(field.field_type)
+    field_args = {"label": field.label, "required": field.required,
+                  "help_text": field.help_text}
+    arg_names = field_class.__init__.__code__.co_varnames
+    if "max_length" in arg_names:
+        field_args["max_length"] = settings.FIELD_MAX_LENGTH
+    if "choices" in arg_names:
+        choices = list(field.get_choices())
+        if field.field_type == fields.SELECT and not (field.required and field.default):
+            # The first OPTION with attr. value="" display only if...
+            #   1. ...the field is not required.
+            #   2. ...the field is required and the default is not set.
+            text = "" if field.placeholder_text is None else field.placeholder_text
+            choices.insert(0, ("", text))
+        field_args["choices"] = choices
+    if field_widget is not None:
+        field_args["widget"] = field_widget
+    form_field = field_class(**field_args)
+
+    # Add identifying CSS classes to the field.
+    css_class = field_class.__name__.lower()
+    # Do not add the 'required' field to the CheckboxSelectMultiple because it will 
+    # mean that all checkboxes have to be checked instead of the usual use case of
+    # "at least one".  
+    if field.required and (field_widget != forms.CheckboxSelectMultiple):
+        css_class += " required"
+        if settings.USE_HTML5:
+            # Except Django version 1.10 this is necessary for all versions from 1.8 to 1.11.
+            form_field.widget.attrs["required"] = "required"
+
+    form_field.widget.attrs["class"] = css_class
+    if field.placeholder_text and not field.default and field.field_type != fields.SELECT:
+        # Attribute `placeholder` not allowed on element `select` at this point.
+        # See https://developer.mozilla.org/en-US/docs/Web/HTML/Element/select
+        # or check the code in https://validator.w3.org.
+        text = field.placeholder_text
+        form_field.widget.attrs["placeholder"] = text
+    return form_field
+
+
+class FormSchema(object):
+    """
+    The visible fields of a form at a given version, along with the
+    form field instances built for them. Schemas are built once per
+    form version and shared between ``FormForForm`` instances, which
+    only need to copy the prebuilt form fields.
+    """
+
+    def __init__(self, form_fields):
+        self.form_fields = form_fields
+        self.fields = OrderedDict()
+        self.defaults = {}
+        self.templates = OrderedDict()
+        for field in form_fields:
+            self.fields[field.slug] = build_field(field)
+            # Only defaults containing template syntax are compiled
+            # and rendered, others are used as is.
+            if is_template(field.default):
+                self.templates[field.slug] = Template(field.default)
+            elif field.default:
+                self.defaults[field.slug] = field.default
+
+    def render_defaults(self, context, field_keys):
+        """
+        Render the template defaults for the given field keys. The
+        context is bound to a template only once for all of them,
+        which for a ``RequestContext`` means running the context
+        processors once, rather than once per default.
+        """
+        defaults = {}
+        templates = [(k, t) for k, t in self.templates.items()
+                     if k in field_keys]
+        if not templates:
+            return defaults
+        if context.template is not None:
+            for field_key, template in templates:
+                defaults[field_key] = template.render(context)
+            return defaults
+        with context.bind_template(templates[0][1]):
+            for field_key, template in templates:
+                defaults[field_key] = template.render(context)
+        return defaults
+
+    @classmethod
+    def for_form(cls, form):
+        """
+        Return the schema for the form's current version, from the
+        process level cache if possible, otherwise building it from
+        the field list held in Django's cache, or from the database.
+        """
+        opts = form._meta
+        key = "forms_builder.schema.%s.%s.%s.%s" % (opts.app_label,
+            opts.model_name, form.pk, form.version)
+        schema = schema_cache.get(key)
+        if schema is None:
+            cache = caches[settings.CACHE_ALIAS]
+            form_fields = cache.get(key)
+            if form_fields is None:
+                form_fields = list(form.fields.visible())
+                cache.set(key, form_fields)
+            schema = cls(form_fields)
+            schema_cache.set(key, schema)
+        return schema
+
+
+schema_cache = LRUCache(settings.SCHEMA_CACHE_SIZE)
+
+
+FORM_FULL_ERROR = _("This form is no longer accepting entries.")
+
+# Name of the hidden input holding the token that identifies each
+# submission, so that repeated submissions can be recognised.
+SUBMISSION_TOKEN_FIELD = "submission_token"
+
+
 class FormForForm(forms.ModelForm):
     field_entry_model = FieldEntry
 
@@ -138,36 +278,32 @@ class FormForForm(forms.ModelForm):
         instance and its related field model instances.
         """
         self.form = form
-        self.form_fields = form.fields.visible()
+        schema = FormSchema.for_form(form)
+        self.form_fields = schema.form_fields
         initial = kwargs.pop("initial", {})
         # If a FormEntry instance is given to edit, stores it's field
-        # values for using as initial data.
-        field_entries = {}
+        # entries for using as initial data, and for updating in save().
+        self.field_entries = {}
         if kwargs.get("instance"):
             for field_entry in kwargs["instance"].fields.all():
-                field_entries[field_entry.field_id] = field_entry.value
+                self.field_entries[field_entry.field_id] = field_entry
+        field_entries = dict((field_id, field_entry.value) for
+                             field_id, field_entry in
+                             self.field_entries.items())
         super(FormForForm, self).__init__(*args, **kwargs)
+        # Render the template defaults needed, for fields that don't
+        # have an initial value from an entry or the initial dict.
+        defaults = schema.defaults
+        if schema.templates:
+            field_keys = [f.slug for f in self.form_fields
+                          if f.id not in field_entries
+                          and f.slug not in initial]
+            defaults = dict(defaults)
+            defaults.update(schema.render_defaults(context, field_keys))
         # Create the form fields.
         for field in self.form_fields:
             field_key = field.slug
-            field_class = fields.CLASSES[field.field_type]
-            field_widget = fields.WIDGETS.get(field.field_type)
-            field_args = {"label": field.label, "required": field.required,
-                          "help_text": field.help_text}
-            arg_names = field_class.__init__.__code__.co_varnames
-            if "max_length" in arg_names:
-                field_args["max_length"] = settings.FIELD_MAX_LENGTH
-            if "choices" in arg_names:
-                choices = list(field.get_choices())
-                if field.field_type == fields.SELECT and not (field.required and field.default):
-                    # The first OPTION with attr. value="" display only if...
-                    #   1. ...the field is not required.
-                    #   2. ...the field is required and the default is not set.
-                    text = "" if field.placeholder_text is None else field.placeholder_text
-                    choices.insert(0, ("", text))
-                field_args["choices"] = choices
-            if field_widget is not None:
-                field_args["widget"] = field_widget
+            self.fields[field_key] = deepcopy(schema.fields[field_key])
             #
             #   Initial value for field, in order of preference:
             #
@@ -186,72 +322,127 @@ class FormForForm(forms.ModelForm):
                 try:
                     initial_val = initial[field_key]
                 except KeyError:
-                    initial_val = Template(field.default).render(context)
+                    initial_val = defaults.get(field_key)
             if initial_val:
                 if field.is_a(*fields.MULTIPLE):
                     initial_val = split_choices(initial_val)
                 if field.field_type == fields.CHECKBOX:
                     initial_val = initial_val != "False"
                 self.initial[field_key] = initial_val
-            self.fields[field_key] = field_class(**field_args)
 
             if field.field_type == fields.DOB:
                 now = datetime.now()
                 years = list(range(now.year, now.year - 120, -1))
                 self.fields[field_key].widget.years = years
 
-            # Add identifying CSS classes to the field.
-            css_class = field_class.__name__.lower()
-            # Do not add the 'required' field to the CheckboxSelectMultiple because it will 
-            # mean that all checkboxes have to be checked instead of the usual use case of
-            # "at least one".  
-            if field.required and (field_widget != forms.CheckboxSelectMultiple):
-                css_class += " required"
-                if settings.USE_HTML5:
-                    # Except Django version 1.10 this is necessary for all versions from 1.8 to 1.11.
-                    self.fields[field_key].widget.attrs["required"] = "required"
-
-            self.fields[field_key].widget.attrs["class"] = css_class
-            if field.placeholder_text and not field.default and field.field_type != fields.SELECT:
-                # Attribute `placeholder` not allowed on element `select` at this point.
-                # See https://developer.mozilla.org/en-US/docs/Web/HTML/Element/select
-                # or check the code in https://validator.w3.org.
-                text = field.placeholder_text
-                self.fields[field_key].widget.attrs["placeholder"] = text
+        # The token identifying the submission, kept when the form is
+        # shown again with errors. HTML rendered for caching, with the
+        # CSRF token marker in place of the token, gets a marker for the
+        # submission token too, replaced with a new token for each
+        # request.
+        self.submission_token = None
+        if settings.IDEMPOTENCY_TIMEOUT is not None:
+            if self.is_bound:
+                self.submission_token = self.data.get(SUBMISSION_TOKEN_FIELD)
+            elif context.get("csrf_token") == CSRF_TOKEN_MARKER:
+                self.submission_token = SUBMISSION_TOKEN_MARKER
+            else:
+                self.submission_token = uuid4().hex
+
+    def submission_token_input(self):
+        """
+        Returns the hidden input for the submission token, posted back
+        with the form so that repeated submissions can be recognised.
+        """
+        if not self.submission_token:
+            return ""
+        return mark_safe(forms.HiddenInput().render(SUBMISSION_TOKEN_FIELD,
+                                                    self.submission_token))
+
+    def clean(self):
+        """
+        Reject new entries once the form has received its maximum
+        number of entries, going by the count already loaded.
+        """
+        cleaned_data = super(FormForForm, self).clean()
+        if self.instance.pk is None and self.form.is_full():
+            raise forms.ValidationError(FORM_FULL_ERROR)
+        return cleaned_data
 
     def save(self, **kwargs):
         """
         Get/create a FormEntry instance and assign submitted values to
-        related FieldEntry instances for each form field.
+        related FieldEntry instances for each form field. New entries
+        are counted against the form, and raise ``ValidationError`` if
+        the form received its last entry since it was validated.
         """
         entry = super(FormForForm, self).save(commit=False)
+        adding = entry.pk is None
         entry.form = self.form
         entry.entry_time = now()
-        entry.save()
-        entry_fields = entry.fields.values_list("field_id", flat=True)
-        new_entry_fields = []
+        values = OrderedDict()
         for field in self.form_fields:
             field_key = field.slug
             value = self.cleaned_data[field_key]
-            if value and self.fields[field_key].widget.needs_multipart_form:
-                value = fs.save(join("forms", str(uuid4()), value.name), value)
+            widget = self.fields[field_key].widget
+            if value and widget.needs_multipart_form:
+                name = join("forms", str(uuid4()), value.name)
+                with metrics.timed("file_save", self.form.id):
+                    value = fs.save(name, value)
             if isinstance(value, list):
                 value = ", ".join([v.strip() for v in value])
-            if field.id in entry_fields:
-                field_entry = entry.fields.get(field_id=field.id)
-                field_entry.value = value
-                field_entry.save()
-            else:
-                new = {"entry": entry, "field_id": field.id, "value": value}
-                new_entry_fields.append(self.field_entry_model(**new))
-        if new_entry_fields:
-            if django.VERSION >= (1, 4, 0):
-                self.field_entry_model.objects.bulk_create(new_entry_fields)
-            else:
-                for field_entry in new_entry_fields:
-                    field_entry.save()
+            values[field.id] = value
+        # Denormalize all of the entry's values onto the entry itself,
+        # including those of any fields not on the form being edited.
+        snapshot = dict((field_id, field_entry.value) for
+                        field_id, field_entry in self.field_entries.items())
+        snapshot.update(values)
+        entry.set_snapshot(snapshot)
+        new_entry_fields = []
+        changed_entry_fields = []
+        with transaction.atomic():
+            if adding and not self.form.increment_entries():
+                raise forms.ValidationError(FORM_FULL_ERROR)
+            entry.save()
+            for field_id, value in values.items():
+                field_entry = self.field_entries.get(field_id)
+                if field_entry is not None:
+                    if field_entry.value != value:
+                        field_entry.value = value
+                        changed_entry_fields.append(field_entry)
+                else:
+                    new = {"entry": entry, "field_id": field_id,
+                           "value": value}
+                    new_entry_fields.append(self.field_entry_model(**new))
+            if changed_entry_fields:
+                self.update_entry_fields(changed_entry_fields)
+            if new_entry_fields:
+                if django.VERSION >= (1, 4, 0):
+                    manager = self.field_entry_model.objects
+                    manager.bulk_create(new_entry_fields)
+                else:
+                    for field_entry in new_entry_fields:
+                        field_entry.save()
         return entry
 
+    def update_entry_fields(self, field_entries):
+        """
+        Write the changed values of existing FieldEntry instances with a
+        single UPDATE query, rather than saving each one in turn. Values
+        are converted as saving them would, so that values such as
+        booleans and dates are stored as they are for new entries.
+        """
+        manager = self.field_entry_model.objects
+        if django.VERSION >= (2, 2, 0):
+            manager.bulk_update(field_entries, ["value"])
+            return
+        prep = self.field_entry_model._meta.get_field("value").get_prep_value
+        whens = [When(id=f.id, then=Value(prep(f.value)))
+                 for f in field_entries]
+        value = Case(*whens, output_field=models.CharField())
+        ids = [f.id for f in field_entries]
+        manager.filter(id__in=ids).update(value=value)
+
     def email_to(self):
         """
         Return the value entered for the first field of type EmailField.
@@ -366,9 +557,163 @@ class EntriesForm(forms.Form):
             fields.append(self.entry_time_name)
         return fields
 
-    def rows(self, csv=False):
+    def filters(self):
         """
-        Returns each row based on the selected criteria.
+        Returns the filter type and list of filter arguments for each
+        field with a filter selected, keyed by field ID.
+        """
+        filters = {}
+        for field in self.form_fields:
+            field_key = "field_%s" % field.id
+            filter_type = self.posted_data("%s_filter" % field_key)
+            filter_args = None
+            if filter_type == FILTER_CHOICE_BETWEEN:
+                filter_args = [self.posted_data("%s_from" % field_key),
+                               self.posted_data("%s_to" % field_key)]
+                if not any(filter_args):
+                    filter_args = None
+            elif filter_type:
+                filter_args = self.posted_data("%s_contains" % field_key)
+                if filter_args:
+                    filter_args = [filter_args]
+            if filter_args:
+                filters[field.id] = (filter_type, filter_args)
+        return filters
+
+    def filter_lookups(self, field, filter_type, filter_args):
+        """
+        Returns the lookups on field entry values for the given field
+        that are equivalent to the filter, and whether entries with a
+        matching field entry should be excluded rather than included.
+        Returns None for filters that can only be applied in Python.
+        """
+        if filter_type == FILTER_CHOICE_BETWEEN:
+            # Dates are stored as ISO formatted strings, so can be
+            # compared as strings.
+            if not field.is_a(*fields.DATES):
+                return None
+            lookups = {}
+            date_from, date_to = filter_args
+            if date_from:
+                lookups["value__gte"] = str(date_from)
+            if date_to:
+                lookups["value__lt"] = str(date_to + timedelta(days=1))
+            return lookups, False
+        if field.is_a(*fields.MULTIPLE):
+            # Values contain multiple choices that need to be split.
+            return None
+        try:
+            lookup, exclude = FILTER_LOOKUPS[filter_type]
+        except KeyError:
+            return None
+        return {lookup: filter_args[0]}, exclude
+
+    def apply_filters(self, queryset, prefix=""):
+        """
+        Applies the criteria that can be evaluated by the database to
+        the given queryset of entries, or of field entries when given
+        the ``entry__`` prefix, returning the filtered queryset along
+        with the filters that still need to be applied to each row.
+        """
+        if self.posted_data("field_0_filter") == FILTER_CHOICE_BETWEEN:
+            time_from = self.posted_data("field_0_from")
+            time_to = self.posted_data("field_0_to")
+            if time_from and time_to:
+                queryset = queryset.filter(**{
+                    "%sentry_time__range" % prefix: (time_from, time_to)})
+
+        # Filter by field values using a subquery of the entries with a
+        # matching value for each field, so that only matching entries
+        # are read.
+        filters = self.filters()
+        for field in self.form_fields:
+            if field.id not in filters:
+                continue
+            lookups = self.filter_lookups(field, *filters[field.id])
+            if lookups is not None:
+                lookups, exclude = lookups
+                matches = self.fieldentry_model.objects.filter(
+                    field_id=field.id, **lookups).values("entry_id")
+                matches = {"%sid__in" % prefix: matches}
+                if exclude:
+                    queryset = queryset.exclude(**matches)
+                else:
+                    queryset = queryset.filter(**matches)
+                del filters[field.id]
+        return queryset, filters
+
+    def entries(self):
+        """
+        Returns a queryset of all the entries matching the selected
+        criteria, for acting on them at once, such as deleting them.
+        """
+        entries = self.formentry_model.objects.filter(form=self.form)
+        entries, filters = self.apply_filters(entries)
+        if filters:
+            # Some filters can only be checked against each row.
+            ids = [row[0] for row in self.rows()]
+            entries = entries.filter(id__in=ids)
+        return entries
+
+    def filter_data(self):
+        """
+        Returns the posted data for the filters, without the choice of
+        fields to export, as a dict mapping each name to its list of
+        values, for storing and applying the same filters later via
+        ``entries``.
+        """
+        return dict((name, self.data.getlist(name)) for name in self.data
+                    if name.startswith("field_") and
+                    not name.endswith("_export"))
+
+    def iterator(self, queryset):
+        """
+        Iterate the queryset in chunks rather than caching it all, so
+        memory use doesn't grow with the number of entries.
+        """
+        if django.VERSION >= (2, 0):
+            return queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        return queryset.iterator()
+
+    def snapshot_field_entries(self, entries, file_field_ids):
+        """
+        Generates unsaved field entries from the snapshot of each of the
+        given entries, so that rows can be built from them without
+        reading the field entries themselves. The IDs of file field
+        entries, needed for their download links, are read for each
+        chunk of entries at once.
+        """
+        while True:
+            chunk = list(islice(entries, settings.EXPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            file_entry_ids = {}
+            if file_field_ids:
+                file_entries = self.fieldentry_model.objects.filter(
+                    entry_id__in=[entry.id for entry in chunk],
+                    field_id__in=file_field_ids)
+                for entry_id, field_id, field_entry_id in \
+                        file_entries.values_list("entry_id", "field_id", "id"):
+                    file_entry_ids[(entry_id, field_id)] = field_entry_id
+            for entry in chunk:
+                for field_id, value in entry.get_snapshot().items():
+                    yield self.fieldentry_model(
+                        id=file_entry_ids.get((entry.id, field_id)),
+                        entry=entry, field_id=field_id, value=value)
+
+    def rows(self, csv=False, before=None, after=None):
+        """
+        Returns each row based on the selected criteria, newest first.
+        For paging through entries, ``before`` limits the rows to those
+        for entries with a lower ID, and ``after`` limits them to those
+        with a higher ID, ordered oldest first.
+        """
+        rows = self.build_rows(csv=csv, before=before, after=after)
+        return metrics.timed_iterator("rows", self.form.id, rows)
+
+    def build_rows(self, csv=False, before=None, after=None):
+        """
+        Generates the rows returned by ``rows``.
         """
 
         # Store the index of each field against its ID for building each
@@ -390,17 +735,30 @@ class EntriesForm(forms.Form):
         if include_entry_time:
             num_columns += 1
 
-        # Get the field entries for the given form and filter by entry_time
-        # if specified.
-        model = self.fieldentry_model
-        field_entries = model.objects.filter(entry__form=self.form
-            ).order_by("-entry__id").select_related("entry")
-        if self.posted_data("field_0_filter") == FILTER_CHOICE_BETWEEN:
-            time_from = self.posted_data("field_0_from")
-            time_to = self.posted_data("field_0_to")
-            if time_from and time_to:
-                field_entries = field_entries.filter(
-                    entry__entry_time__range=(time_from, time_to))
+        # Get the field entries for the given form, filtered by the
+        # criteria that the database can apply, and starting from the
+        # given entry ID if paging through entries. Once every entry has
+        # a snapshot of its values, build the rows from those instead,
+        # reading a single row per entry.
+        entries = self.formentry_model.objects.filter(form=self.form)
+        if entries.filter(snapshot__isnull=True).exists():
+            model = self.fieldentry_model
+            field_entries = model.objects.filter(entry__form=self.form
+                ).order_by("-entry__id").select_related("entry")
+            prefix = "entry__"
+        else:
+            field_entries = entries.order_by("-id")
+            prefix = ""
+        field_entries, filters = self.apply_filters(field_entries, prefix)
+        if before is not None:
+            field_entries = field_entries.filter(**{prefix + "id__lt": before})
+        if after is not None:
+            field_entries = field_entries.filter(**{prefix + "id__gt": after})
+            field_entries = field_entries.order_by(prefix + "id")
+        field_entries = self.iterator(field_entries)
+        if not prefix:
+            field_entries = self.snapshot_field_entries(field_entries,
+                                                        file_field_ids)
 
         # Loop through each field value ordered by entry, building up each
         # entry as a row. Use the ``valid_row`` flag for marking a row as
@@ -423,17 +781,12 @@ class EntriesForm(forms.Form):
             field_value = field_entry.value or ""
             # Check for filter.
             field_id = field_entry.field_id
-            filter_type = self.posted_data("field_%s_filter" % field_id)
-            filter_args = None
-            if filter_type:
-                if filter_type == FILTER_CHOICE_BETWEEN:
-                    f, t = "field_%s_from" % field_id, "field_%s_to" % field_id
-                    filter_args = [self.posted_data(f), self.posted_data(t)]
-                else:
-                    field_name = "field_%s_contains" % field_id
-                    filter_args = self.posted_data(field_name)
-                    if filter_args:
-                        filter_args = [filter_args]
+            try:
+                filter_type, filter_args = filters[field_id]
+            except KeyError:
+                filter_args = None
+            else:
+                filter_args = list(filter_args)
             if filter_args:
                 # Convert dates before checking filter.
                 if field_id in date_field_ids:
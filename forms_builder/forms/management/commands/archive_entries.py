@@ -0,0 +1,107 @@
+from __future__ import unicode_literals
+
+import gzip
+import json
+from datetime import datetime, timedelta
+from tempfile import TemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from forms_builder.forms.models import Form, FormEntry, FieldEntry
+from forms_builder.forms.utils import archive_storage, now
+
+
+def next_month(month):
+    """
+    Returns the start of the month after the given month.
+    """
+    month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+    if settings.USE_TZ:
+        month = timezone.make_aware(month)
+    return month
+
+
+class Command(BaseCommand):
+    help = ("Archives the entries of each form older than the form's "
+            "retention period to gzipped JSON Lines files, one for each "
+            "month of entries, on the storage given by the "
+            "FORMS_BUILDER_ARCHIVE_STORAGE setting, and then deletes them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+            help="Number of entries read and deleted at a time.")
+
+    def handle(self, **options):
+        storage = archive_storage()
+        batch_size = options["batch_size"]
+        for form in Form.objects.filter(retention_days__isnull=False):
+            cutoff = now() - timedelta(days=form.retention_days)
+            expired = FormEntry.objects.filter(form=form,
+                                               entry_time__lt=cutoff)
+            for month in expired.datetimes("entry_time", "month"):
+                entries = expired.filter(entry_time__gte=month,
+                                         entry_time__lt=next_month(month))
+                name, last_id = self.archive(form, month, entries, storage,
+                                             batch_size)
+                # Only delete the entries written to the archive.
+                entries = entries.filter(id__lte=last_id)
+                deleted = entries.delete_in_batches(batch_size)
+                if int(options["verbosity"]) > 0:
+                    self.stdout.write("Archived %s entries to %s" %
+                                      (deleted, name))
+
+    def archive(self, form, month, entries, storage, batch_size):
+        """
+        Write the entries to an archive for the form and month, with a
+        line for each entry holding its entry time and the value for
+        each field's slug, as read by the ``restore_entries`` command.
+        Returns the name of the archive and the ID of the last entry
+        written. When a month is archived again, such as after the
+        retention period is reduced, a new archive is written
+        alongside the first.
+        """
+        slugs = dict((field.id, field.slug) for field in form.fields.all())
+        last_id = 0
+        with TemporaryFile() as f:
+            archive = gzip.GzipFile(fileobj=f, mode="wb")
+            while True:
+                batch = list(entries.filter(id__gt=last_id).order_by("id")[
+                    :batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                for entry, values in self.entry_values(batch):
+                    record = {"entry_time": entry.entry_time.isoformat()}
+                    for field_id, value in values.items():
+                        if field_id in slugs:
+                            record[slugs[field_id]] = value
+                    line = json.dumps(record, sort_keys=True) + "\n"
+                    archive.write(line.encode("utf-8"))
+            archive.close()
+            f.seek(0)
+            name = "forms_builder/archives/%s/%s.jsonl.gz" % (form.slug,
+                month.strftime("%Y-%m"))
+            name = storage.save(name, File(f))
+        return name, last_id
+
+    def entry_values(self, entries):
+        """
+        Generates each entry along with a dict mapping field IDs to
+        values, from the entry's snapshot, or from its field entries
+        for entries without a snapshot, read for all of them at once.
+        """
+        field_values = {}
+        missing = [entry.id for entry in entries if entry.snapshot is None]
+        if missing:
+            field_entries = FieldEntry.objects.filter(entry_id__in=missing)
+            for entry_id, field_id, value in field_entries.values_list(
+                    "entry_id", "field_id", "value"):
+                field_values.setdefault(entry_id, {})[field_id] = value
+        for entry in entries:
+            values = entry.get_snapshot()
+            if values is None:
+                values = field_values.get(entry.id, {})
+            yield entry, values
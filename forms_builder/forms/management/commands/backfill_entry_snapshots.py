@@ -0,0 +1,45 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forms_builder.forms.models import FormEntry, FieldEntry
+
+
+class Command(BaseCommand):
+    help = ("Stores the snapshot of field values on each form entry "
+            "saved before entries had them, so that exporting and "
+            "listing entries can read them from a single row.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+            help="Number of entries updated in each transaction.")
+        parser.add_argument("--all", action="store_true",
+            help="Rebuild the snapshots of all entries, rather than "
+                 "only those without one.")
+
+    def handle(self, **options):
+        entries = FormEntry.objects.order_by("id")
+        if not options["all"]:
+            entries = entries.filter(snapshot__isnull=True)
+        last_id = 0
+        total = 0
+        while True:
+            batch = list(entries.filter(id__gt=last_id)
+                         [:options["batch_size"]])
+            if not batch:
+                break
+            values = dict((entry.id, {}) for entry in batch)
+            field_entries = FieldEntry.objects.filter(entry_id__in=values)
+            for entry_id, field_id, value in field_entries.values_list(
+                    "entry_id", "field_id", "value"):
+                values[entry_id][field_id] = value
+            with transaction.atomic():
+                for entry in batch:
+                    entry.set_snapshot(values[entry.id])
+                    FormEntry.objects.filter(id=entry.id).update(
+                        snapshot=entry.snapshot)
+            last_id = batch[-1].id
+            total += len(batch)
+            if int(options["verbosity"]) > 1:
+                self.stdout.write("Stored snapshots of %s entries" % total)
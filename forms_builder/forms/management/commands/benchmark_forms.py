@@ -0,0 +1,60 @@
+from __future__ import unicode_literals
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+
+from forms_builder.forms import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks building, submitting, listing and exporting forms "
+            "against generated data in a new test database, such as an "
+            "in-memory SQLite database, reporting the time, peak memory "
+            "and queries for each.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fields", type=int, nargs="+",
+            default=[10, 100], help="Numbers of fields to benchmark.")
+        parser.add_argument("--entries", type=int, nargs="+",
+            default=[100, 1000], help="Numbers of entries to benchmark.")
+        parser.add_argument("--forms", type=int, default=100,
+            help="Number of published forms to benchmark.")
+        parser.add_argument("--repeat", type=int, default=5,
+            help="Number of times each benchmark is timed.")
+        parser.add_argument("--output",
+            help="File to write the results to as JSON, for comparing "
+                 "between versions.")
+
+    def handle(self, **options):
+        setup_test_environment()
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = []
+            for result in benchmarks.run(options["fields"],
+                                         options["entries"],
+                                         options["forms"],
+                                         options["repeat"]):
+                self.stdout.write(self.format_result(result))
+                results.append(result)
+            environment = benchmarks.environment()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump({"environment": environment, "results": results},
+                          f, indent=2, sort_keys=True)
+
+    def format_result(self, result):
+        sizes = ["%s %s" % (result[size], size) for size in
+                 ("forms", "fields", "entries") if size in result]
+        line = "%-18s %-22s %9.2fms %6s queries" % (result["name"],
+            ", ".join(sizes), result["time"] * 1000, result["queries"])
+        if result["peak_memory"] is not None:
+            line += " %9.1fKB peak" % (result["peak_memory"] / 1024.)
+        return line
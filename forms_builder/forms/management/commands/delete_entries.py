@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from forms_builder.forms.models import EntryDeletion
+
+
+class Command(BaseCommand):
+    help = ("Deletes the entries left to be deleted in the background when "
+            "the FORMS_BUILDER_DELETE_IN_BACKGROUND setting is enabled.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+            help="Number of entries deleted in each transaction, by "
+                 "default the FORMS_BUILDER_DELETE_BATCH_SIZE setting.")
+        parser.add_argument("--loop", action="store_true",
+            help="Keep running, polling for new deletions.")
+        parser.add_argument("--interval", type=float, default=5,
+            help="Seconds to wait between polls when looping.")
+
+    def handle(self, **options):
+        while True:
+            deletion = EntryDeletion.objects.run_next(options["batch_size"])
+            if deletion is not None and int(options["verbosity"]) > 1:
+                self.stdout.write("Deleted %s of %s entries for %s: %s" % (
+                    deletion.deleted, deletion.total, deletion.form,
+                    deletion.get_status_display()))
+            if not options["loop"]:
+                if deletion is None:
+                    break
+            elif deletion is None:
+                sleep(options["interval"])
@@ -0,0 +1,213 @@
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from future.utils import PY2
+
+from forms_builder.forms import fields
+from forms_builder.forms.forms import build_field
+from forms_builder.forms.models import Form, FormEntry, FieldEntry
+from forms_builder.forms.models import invalidate_forms_cache
+from forms_builder.forms.utils import now, split_choices
+
+
+def decode(value):
+    """
+    Returns the value read as bytes by Python 2's csv module as text.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+
+class Command(BaseCommand):
+    help = ("Imports entries for a form from a CSV or JSON Lines file, "
+            "with a column or key for each field's slug, and optionally "
+            "an entry_time. Values are validated for each field's type, "
+            "other than file fields, whose values are the names of files "
+            "already in storage.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("form", help="ID or slug of the form.")
+        parser.add_argument("path", help="CSV or JSON Lines file.")
+        parser.add_argument("--format", choices=("csv", "jsonl"),
+            help="Format of the file, by default from its extension.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+            help="Number of entries written in each transaction.")
+        parser.add_argument("--resume", action="store_true",
+            help="Continue an import that was interrupted, skipping "
+                 "the records already imported.")
+
+    def handle(self, **options):
+        form = self.get_form(options["form"])
+        path = options["path"]
+        fmt = options["format"]
+        if fmt is None:
+            fmt = "csv" if path.lower().endswith(".csv") else "jsonl"
+        progress_path = path + ".progress"
+        done = 0
+        if os.path.exists(progress_path):
+            if not options["resume"]:
+                raise CommandError("%s exists from an interrupted import, "
+                                   "use --resume to continue it, or "
+                                   "delete it to start again" % progress_path)
+            with open(progress_path) as f:
+                done = int(f.read())
+
+        # Build each field's form field once, for validating values.
+        form_fields = dict((field.slug, (field, build_field(field)))
+                           for field in form.fields.all())
+        imported = invalid = 0
+        if PY2 and fmt == "csv":
+            # Python 2's csv module only reads bytes.
+            f = open(path, "rb")
+        else:
+            f = io.open(path, encoding="utf-8", newline="")
+        with f:
+            records = self.read_records(f, fmt, form_fields)
+            records = islice(enumerate(records, 1), done, None)
+            while True:
+                batch = list(islice(records, options["batch_size"]))
+                if not batch:
+                    break
+                entries = []
+                for number, record in batch:
+                    try:
+                        entries.append(self.clean(record, form_fields))
+                    except ValidationError as e:
+                        invalid += 1
+                        self.stderr.write("Record %s: %s" %
+                                          (number, "; ".join(e.messages)))
+                self.save(form, entries)
+                imported += len(entries)
+                done = batch[-1][0]
+                with open(progress_path, "w") as progress:
+                    progress.write(str(done))
+                if int(options["verbosity"]) > 0:
+                    self.stdout.write("Imported %s entries, %s invalid, "
+                                      "%s records read" %
+                                      (imported, invalid, done))
+        os.remove(progress_path)
+        # Entry counts may have closed the form.
+        invalidate_forms_cache()
+
+    def get_form(self, form):
+        """
+        Return the form for the given ID or slug.
+        """
+        try:
+            if form.isdigit():
+                return Form.objects.get(id=form)
+            return Form.objects.get(slug=form)
+        except Form.DoesNotExist:
+            raise CommandError("No form with the ID or slug %s" % form)
+
+    def read_records(self, f, fmt, form_fields):
+        """
+        Generates a dict for each record in the file, first checking
+        that its columns are the form's field slugs.
+        """
+        if fmt == "csv":
+            reader = csv.DictReader(f)
+            columns = [decode(column) for column in reader.fieldnames or []]
+            self.check_columns(columns, form_fields)
+            for record in reader:
+                if PY2:
+                    record = dict((decode(name), decode(value))
+                                  for name, value in record.items())
+                yield record
+            return
+        checked = False
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not checked:
+                self.check_columns(record.keys(), form_fields)
+                checked = True
+            yield record
+
+    def check_columns(self, columns, form_fields):
+        unknown = set(columns) - set(form_fields) - set(["entry_time"])
+        if unknown:
+            raise CommandError("Unknown fields: %s" %
+                               ", ".join(sorted(unknown)))
+
+    def clean(self, record, form_fields):
+        """
+        Return the entry time and dict of field IDs to values for the
+        record, stored as ``FormForForm.save`` stores them, raising
+        ``ValidationError`` if any values aren't valid.
+        """
+        entry_time = record.get("entry_time")
+        if entry_time:
+            entry_time = parse_datetime(entry_time)
+            if entry_time is None:
+                raise ValidationError("entry_time: Enter a valid date/time.")
+            if settings.USE_TZ and timezone.is_naive(entry_time):
+                entry_time = timezone.make_aware(entry_time)
+        else:
+            entry_time = now()
+        values = {}
+        errors = []
+        for slug, (field, form_field) in form_fields.items():
+            value = record.get(slug)
+            if field.is_a(fields.FILE):
+                values[field.id] = value or ""
+                continue
+            if field.is_a(*fields.MULTIPLE) and not isinstance(value, list):
+                value = split_choices(value or "")
+            try:
+                value = form_field.clean(value)
+            except ValidationError as e:
+                errors.extend(["%s: %s" % (slug, message)
+                               for message in e.messages])
+                continue
+            if isinstance(value, list):
+                value = ", ".join([v.strip() for v in value])
+            values[field.id] = value
+        if errors:
+            raise ValidationError(errors)
+        return entry_time, values
+
+    def save(self, form, entries):
+        """
+        Write the entries and their field entries in one transaction,
+        with a single INSERT for all of their field entries. The form
+        entries are also inserted at once where the database returns
+        their IDs, and otherwise inserted one at a time.
+        """
+        if not entries:
+            return
+        form_entries = []
+        for entry_time, values in entries:
+            entry = FormEntry(form=form, entry_time=entry_time)
+            entry.set_snapshot(values)
+            form_entries.append(entry)
+        features = connection.features
+        bulk_ids = (getattr(features, "can_return_rows_from_bulk_insert",
+                            False) or
+                    getattr(features, "can_return_ids_from_bulk_insert",
+                            False))
+        with transaction.atomic():
+            if bulk_ids:
+                FormEntry.objects.bulk_create(form_entries)
+            else:
+                for entry in form_entries:
+                    entry.save()
+            FieldEntry.objects.bulk_create([
+                FieldEntry(entry=entry, field_id=field_id, value=value)
+                for entry, (_, values) in zip(form_entries, entries)
+                for field_id, value in values.items()])
+            Form.objects.filter(id=form.id).update(
+                entry_count=models.F("entry_count") + len(entries))
@@ -0,0 +1,48 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from django.utils import translation
+
+from forms_builder.forms.models import Form
+from forms_builder.forms.settings import PAGE_CACHE_TIMEOUT
+from forms_builder.forms.views import form_detail, form_sent
+
+
+class Command(BaseCommand):
+    help = ("Caches the form and form sent pages of each published form "
+            "for anonymous users, such as after deploying, when the "
+            "FORMS_BUILDER_PAGE_CACHE_TIMEOUT setting is enabled. Pages "
+            "are cached in each of the languages in the LANGUAGES setting "
+            "when USE_I18N is enabled, otherwise in LANGUAGE_CODE.")
+
+    # Pages are cached per language, so the active language is set for
+    # each of them rather than deactivated as for other commands.
+    leave_locale_alone = True
+
+    def handle(self, **options):
+        if PAGE_CACHE_TIMEOUT is None:
+            raise CommandError("FORMS_BUILDER_PAGE_CACHE_TIMEOUT is not set")
+        languages = [settings.LANGUAGE_CODE]
+        if settings.USE_I18N:
+            languages = [code for code, name in settings.LANGUAGES]
+        factory = RequestFactory()
+        for form in Form.objects.published():
+            for language in languages:
+                with translation.override(language):
+                    self.prewarm(factory, form, options)
+
+    def prewarm(self, factory, form, options):
+        """
+        Requests the form's pages, caching them in the active language.
+        """
+        for view in (form_detail, form_sent):
+            request = factory.get(form.get_absolute_url())
+            request.user = AnonymousUser()
+            response = view(request, slug=form.slug)
+            if int(options["verbosity"]) > 1:
+                self.stdout.write("%s %s %s: %s" % (view.__name__,
+                    form.slug, translation.get_language(),
+                    response.status_code))
@@ -0,0 +1,25 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from forms_builder.forms.models import Form, invalidate_forms_cache
+
+
+class Command(BaseCommand):
+    help = ("Corrects the entry count stored on each form, for entries "
+            "created or deleted other than via the form or the admin.")
+
+    def handle(self, **options):
+        changed = False
+        counts = Form.objects.annotate(total=Count("entries"))
+        for form_id, entry_count, total in counts.values_list(
+                "id", "entry_count", "total"):
+            if entry_count != total:
+                Form.objects.filter(id=form_id).update(entry_count=total)
+                changed = True
+                if int(options["verbosity"]) > 1:
+                    self.stdout.write("Form %s: %s entries, counted %s" %
+                                      (form_id, total, entry_count))
+        if changed:
+            invalidate_forms_cache()
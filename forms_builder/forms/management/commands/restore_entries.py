@@ -0,0 +1,58 @@
+from __future__ import unicode_literals
+
+import gzip
+import json
+from itertools import islice
+
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_datetime
+
+from forms_builder.forms.management.commands import import_entries
+from forms_builder.forms.models import invalidate_forms_cache
+from forms_builder.forms.utils import archive_storage
+
+
+class Command(import_entries.Command):
+    help = ("Restores the entries in an archive written by the "
+            "archive_entries command to a form. Values are restored as "
+            "they were archived, without validating them, and values for "
+            "fields the form no longer has are skipped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("form", help="ID or slug of the form.")
+        parser.add_argument("name",
+            help="Name of the archive on the archive storage.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+            help="Number of entries written in each transaction.")
+
+    def handle(self, **options):
+        form = self.get_form(options["form"])
+        field_ids = dict((field.slug, field.id)
+                         for field in form.fields.all())
+        storage = archive_storage()
+        if not storage.exists(options["name"]):
+            raise CommandError("No archive named %s" % options["name"])
+        restored = 0
+        with storage.open(options["name"]) as f:
+            lines = gzip.GzipFile(fileobj=f, mode="rb")
+            records = (json.loads(line.decode("utf-8"))
+                       for line in lines if line.strip())
+            while True:
+                batch = list(islice(records, options["batch_size"]))
+                if not batch:
+                    break
+                self.save(form, [self.restore(record, field_ids)
+                                 for record in batch])
+                restored += len(batch)
+                if int(options["verbosity"]) > 0:
+                    self.stdout.write("Restored %s entries" % restored)
+        invalidate_forms_cache()
+
+    def restore(self, record, field_ids):
+        """
+        Return the entry time and dict of field IDs to values for the
+        archived record.
+        """
+        values = dict((field_ids[slug], value)
+                      for slug, value in record.items() if slug in field_ids)
+        return parse_datetime(record["entry_time"]), values
@@ -0,0 +1,31 @@
+from __future__ import unicode_literals
+
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from forms_builder.forms.models import QueuedEmail
+
+
+class Command(BaseCommand):
+    help = ("Sends the form emails queued in the outbox when the "
+            "FORMS_BUILDER_EMAIL_OUTBOX setting is enabled.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100,
+            help="Number of emails sent over each connection.")
+        parser.add_argument("--loop", action="store_true",
+            help="Keep running, polling for new emails.")
+        parser.add_argument("--interval", type=float, default=5,
+            help="Seconds to wait between polls when looping.")
+
+    def handle(self, **options):
+        while True:
+            sent = QueuedEmail.objects.send_batch(options["batch_size"])
+            if sent and int(options["verbosity"]) > 1:
+                self.stdout.write("Processed %s queued emails" % sent)
+            if not options["loop"]:
+                if not sent:
+                    break
+            elif not sent:
+                sleep(options["interval"])
@@ -0,0 +1,148 @@
+"""
+Timing of each stage of handling forms, reported to the function given
+by the ``FORMS_BUILDER_METRICS_BACKEND`` setting and to receivers of the
+``stage_timed`` signal. Stages aren't timed when neither is used.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.db import connection
+
+from forms_builder.forms import settings
+from forms_builder.forms.signals import stage_timed
+from forms_builder.forms.utils import import_attr
+
+
+logger = logging.getLogger("forms_builder.metrics")
+
+backend = None
+if settings.METRICS_BACKEND:
+    backend = import_attr(settings.METRICS_BACKEND)
+
+
+class QueryCounter(object):
+    """
+    Database execute wrapper counting the queries run.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def enabled():
+    """
+    Returns ``True`` if there's anything to report timings to.
+    """
+    return backend is not None or stage_timed.has_listeners()
+
+
+def report(stage, form_id, duration, queries):
+    if backend is not None:
+        backend(stage, form_id, duration, queries)
+    stage_timed.send(sender=None, stage=stage, form_id=form_id,
+                     duration=duration, queries=queries)
+
+
+@contextmanager
+def count_queries():
+    """
+    Yields a ``QueryCounter`` counting the queries run in the block.
+    Django versions before 2.0 can't wrap queries, so the counts of
+    queries are ``None``, unless ``settings.DEBUG`` is enabled.
+    """
+    counter = QueryCounter()
+    if hasattr(connection, "execute_wrapper"):
+        with connection.execute_wrapper(counter):
+            yield counter
+    elif connection.queries_logged:
+        start = len(connection.queries)
+        yield counter
+        counter.count = len(connection.queries) - start
+    else:
+        counter.count = None
+        yield counter
+
+
+@contextmanager
+def timed(stage, form_id):
+    """
+    Times the block as the given stage of handling the form.
+    """
+    if not enabled():
+        yield
+        return
+    with count_queries() as counter:
+        start = default_timer()
+        yield
+        duration = default_timer() - start
+    report(stage, form_id, duration, counter.count)
+
+
+def timed_iterator(stage, form_id, iterator):
+    """
+    Returns the iterator, timing the time spent producing its items as
+    the given stage of handling the form, but not the time spent by
+    the caller between items, such as streaming them to a client.
+    """
+    if not enabled():
+        return iterator
+    return _timed_iterator(stage, form_id, iter(iterator))
+
+
+def _timed_iterator(stage, form_id, iterator):
+    """
+    Generator for ``timed_iterator``. The timing is reported when the
+    iterator is exhausted, and also when the caller stops reading it
+    early, such as when reading a page of rows via ``islice``, once the
+    generator is closed.
+    """
+    duration = 0
+    queries = 0
+    done = False
+    try:
+        while not done:
+            with count_queries() as counter:
+                start = default_timer()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    done = True
+                duration += default_timer() - start
+            if queries is not None and counter.count is not None:
+                queries += counter.count
+            else:
+                queries = None
+            if not done:
+                yield item
+    finally:
+        report(stage, form_id, duration, queries)
+
+
+def log_metrics(stage, form_id, duration, queries):
+    """
+    Metrics backend writing each timing to the
+    ``forms_builder.metrics`` logger.
+    """
+    logger.info("%s form=%s duration=%.1fms queries=%s",
+                stage, form_id, duration * 1000, queries)
+
+
+def statsd_metrics(stage, form_id, duration, queries):
+    """
+    Metrics backend sending each timing to statsd, via the client from
+    the ``statsd`` package configured with its ``STATSD_*`` Django
+    settings. Form IDs aren't included in the metric names, to keep
+    their number fixed.
+    """
+    from statsd.defaults.django import statsd
+    statsd.timing("forms_builder.%s" % stage, duration * 1000)
+    if queries is not None:
+        statsd.incr("forms_builder.%s.queries" % stage, queries)
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0003_auto_20180522_0820'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form',
+            name='version',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 2.1.15 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0004_form_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Subject')),
+                ('from_email', models.CharField(max_length=254, verbose_name='From address')),
+                ('recipients', models.TextField(verbose_name='Recipients')),
+                ('body_text', models.TextField()),
+                ('body_html', models.TextField()),
+                ('attachments', models.TextField(default='[]')),
+                ('headers', models.TextField(default='{}')),
+                ('status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Sent'), (3, 'Failed')], default=1, verbose_name='Status')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Attempts')),
+                ('next_attempt', models.DateTimeField(db_index=True, verbose_name='Next attempt')),
+                ('sent_time', models.DateTimeField(blank=True, null=True, verbose_name='Sent at')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+            ],
+            options={
+                'verbose_name': 'Queued email',
+                'verbose_name_plural': 'Queued emails',
+            },
+        ),
+    ]
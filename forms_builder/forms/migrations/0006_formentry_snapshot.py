@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 15:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0005_queuedemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formentry',
+            name='snapshot',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Snapshot'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.1.15 on 2026-10-18 15:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_entries(apps, schema_editor):
+    Form = apps.get_model("forms", "Form")
+    counts = Form.objects.annotate(total=Count("entries"))
+    for form_id, total in counts.values_list("id", "total"):
+        Form.objects.filter(id=form_id).update(entry_count=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0006_formentry_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form',
+            name='entry_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Entries'),
+        ),
+        migrations.AddField(
+            model_name='form',
+            name='max_entries',
+            field=models.PositiveIntegerField(blank=True, help_text='With a value, the form is closed once it has received this many entries', null=True, verbose_name='Max entries'),
+        ),
+        migrations.RunPython(count_entries, migrations.RunPython.noop),
+    ]
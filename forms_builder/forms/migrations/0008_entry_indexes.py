@@ -0,0 +1,26 @@
+# Generated by Django 2.1.15 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0007_form_entry_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='fieldentry',
+            name='field_id',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='fieldentry',
+            index_together={('entry', 'field_id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='formentry',
+            index_together={('form', 'entry_time'), ('form', 'id')},
+        ),
+    ]
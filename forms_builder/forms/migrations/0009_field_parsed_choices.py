@@ -0,0 +1,31 @@
+# Generated by Django 2.1.15 on 2026-10-18 15:57
+
+import json
+
+from django.db import migrations, models
+
+from forms_builder.forms.utils import parse_choices
+
+
+def parse_field_choices(apps, schema_editor):
+    Field = apps.get_model("forms", "Field")
+    for field in Field.objects.exclude(choices="").only("id", "choices"):
+        parsed_choices = json.dumps(parse_choices(field.choices))
+        Field.objects.filter(id=field.id).update(parsed_choices=parsed_choices)
+    Field.objects.filter(choices="").update(parsed_choices="[]")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0008_entry_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='field',
+            name='parsed_choices',
+            field=models.TextField(editable=False, null=True),
+        ),
+        migrations.RunPython(parse_field_choices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.1.15 on 2026-10-18 16:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0009_field_parsed_choices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntryDeletion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filters', models.TextField(default='{}')),
+                ('status', models.IntegerField(choices=[(1, 'Pending'), (2, 'Running'), (3, 'Done'), (4, 'Failed')], default=1, verbose_name='Status')),
+                ('total', models.IntegerField(default=0, verbose_name='Entries')),
+                ('deleted', models.IntegerField(default=0, verbose_name='Deleted')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Finished')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('form', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deletions', to='forms.Form')),
+            ],
+            options={
+                'verbose_name': 'Entry deletion',
+                'verbose_name_plural': 'Entry deletions',
+            },
+        ),
+    ]
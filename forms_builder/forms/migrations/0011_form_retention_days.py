@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 16:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0010_entrydeletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='With a value, older entries are archived and deleted by the archive_entries command', null=True, verbose_name='Keep entries for (days)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0011_form_retention_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='form',
+            name='throttle_rate',
+            field=models.PositiveIntegerField(blank=True, help_text='With a value, each visitor can only submit the form this many times an hour', null=True, verbose_name='Submissions per hour'),
+        ),
+    ]
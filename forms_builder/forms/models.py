@@ -1,7 +1,16 @@
 from __future__ import unicode_literals
 
+import json
+from datetime import timedelta
+from hashlib import md5
+from math import ceil
+from os.path import basename
+from uuid import uuid4
+
 from django import VERSION as DJANGO_VERSION
 from django.contrib.sites.models import Site
+from django.core.cache import caches
+from django.core.mail import get_connection
 
 try:
     from django.urls import reverse
@@ -9,15 +18,20 @@ except ImportError:
     # For Django 1.8 compatibility
     from django.core.urlresolvers import reverse
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+from django.dispatch import receiver
+from django.template import loader
+from django.utils.datastructures import MultiValueDict
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext, ugettext_lazy as _
+from email_extras.utils import send_mail
 from future.builtins import str
 
 from forms_builder.forms import fields
 from forms_builder.forms import settings
-from forms_builder.forms.utils import now, slugify, unique_slug
+from forms_builder.forms.utils import now, parse_choices, slugify, unique_slug
 
 
 STATUS_DRAFT = 1
@@ -27,11 +41,47 @@ STATUS_CHOICES = (
     (STATUS_PUBLISHED, _("Published")),
 )
 
+EMAIL_STATUS_PENDING = 1
+EMAIL_STATUS_SENT = 2
+EMAIL_STATUS_FAILED = 3
+EMAIL_STATUS_CHOICES = (
+    (EMAIL_STATUS_PENDING, _("Pending")),
+    (EMAIL_STATUS_SENT, _("Sent")),
+    (EMAIL_STATUS_FAILED, _("Failed")),
+)
+
+DELETION_STATUS_PENDING = 1
+DELETION_STATUS_RUNNING = 2
+DELETION_STATUS_DONE = 3
+DELETION_STATUS_FAILED = 4
+DELETION_STATUS_CHOICES = (
+    (DELETION_STATUS_PENDING, _("Pending")),
+    (DELETION_STATUS_RUNNING, _("Running")),
+    (DELETION_STATUS_DONE, _("Done")),
+    (DELETION_STATUS_FAILED, _("Failed")),
+)
+
+
+class FormQuerySet(models.QuerySet):
+
+    def delete(self):
+        """
+        Delete the forms' entries in batches before the forms, rather
+        than letting the forms' deletion cascade to them all at once.
+        Used by the admin's action for deleting the selected forms.
+        """
+        entry_model = self.model._meta.get_field("entries").related_model
+        entry_model.objects.filter(form__in=self).delete_in_batches()
+        return super(FormQuerySet, self).delete()
+
 
 class FormManager(models.Manager):
     """
     Only show published forms for non-staff users.
     """
+    def get_queryset(self):
+        return FormQuerySet(self.model, using=self._db)
+
     def published(self, for_user=None):
         if for_user is not None and for_user.is_staff:
             return self.all()
@@ -39,11 +89,73 @@ class FormManager(models.Manager):
             Q(publish_date__lte=now()) | Q(publish_date__isnull=True),
             Q(expiry_date__gte=now()) | Q(expiry_date__isnull=True),
             Q(status=STATUS_PUBLISHED),
+            (Q(max_entries__isnull=True) |
+             Q(entry_count__lt=models.F("max_entries"))),
         ]
         if settings.USE_SITES:
             filters.append(Q(sites=Site.objects.get_current()))
         return self.filter(*filters)
 
+    def get_published(self, slug, for_user=None):
+        """
+        Return the form with the given slug from ``published``, raising
+        ``DoesNotExist`` if there isn't one. For non-staff users the
+        form is looked up in the cache, where it's stored along with
+        its publish window, and is only loaded from the database on a
+        cache miss. Cached forms expire when their publish window next
+        opens or closes, and are discarded when any form changes.
+        """
+        if for_user is not None and for_user.is_staff:
+            return self.published(for_user=for_user).get(slug=slug)
+        site_id = Site.objects.get_current().id if settings.USE_SITES else 0
+        opts = self.model._meta
+        key = "forms_builder.published.%s.%s.%s.%s" % (opts.app_label,
+            opts.model_name, site_id, md5(slug.encode("utf-8")).hexdigest())
+        cache = caches[settings.CACHE_ALIAS]
+        values = cache.get_many([GENERATION_KEY, key])
+        generation = values.get(GENERATION_KEY)
+        if generation is None:
+            generation = invalidate_forms_cache()
+        try:
+            cached_generation, form = values[key]
+        except KeyError:
+            cached_generation = None
+        if cached_generation != generation:
+            queryset = self.filter(slug=slug)
+            if settings.USE_SITES:
+                queryset = queryset.filter(sites__id=site_id)
+            form = queryset.first()
+            timeout = {}
+            boundaries = []
+            if form is not None:
+                boundaries = [d for d in (form.publish_date, form.expiry_date)
+                              if d is not None and d > now()]
+            if boundaries:
+                seconds = (min(boundaries) - now()).total_seconds()
+                timeout["timeout"] = int(ceil(seconds))
+            cache.set(key, (generation, form), **timeout)
+        # Mimics the filters in ``published``, since the cached form
+        # may have been stored before its publish window changed.
+        if (form is None or form.status != STATUS_PUBLISHED
+                or (form.publish_date and form.publish_date > now())
+                or (form.expiry_date and form.expiry_date < now())
+                or form.is_full()):
+            raise self.model.DoesNotExist
+        return form
+
+
+GENERATION_KEY = "forms_builder.generation"
+
+
+def invalidate_forms_cache():
+    """
+    Store a new generation for the cache used by
+    ``FormManager.get_published``, discarding every cached form.
+    """
+    generation = uuid4().hex
+    caches[settings.CACHE_ALIAS].set(GENERATION_KEY, generation, None)
+    return generation
+
 
 ######################################################################
 #                                                                    #
@@ -90,6 +202,20 @@ class AbstractForm(models.Model):
         max_length=200)
     email_subject = models.CharField(_("Subject"), max_length=200, blank=True)
     email_message = models.TextField(_("Message"), blank=True)
+    max_entries = models.PositiveIntegerField(_("Max entries"), blank=True,
+        null=True, help_text=_("With a value, the form is closed once it "
+                               "has received this many entries"))
+    retention_days = models.PositiveIntegerField(_("Keep entries for (days)"),
+        blank=True, null=True, help_text=_("With a value, older entries are "
+                                           "archived and deleted by the "
+                                           "archive_entries command"))
+    throttle_rate = models.PositiveIntegerField(_("Submissions per hour"),
+        blank=True, null=True, help_text=_("With a value, each visitor can "
+                                           "only submit the form this many "
+                                           "times an hour"))
+    entry_count = models.PositiveIntegerField(_("Entries"), default=0,
+        editable=False)
+    version = models.CharField(max_length=32, editable=False, default="")
 
     objects = FormManager()
 
@@ -104,12 +230,38 @@ class AbstractForm(models.Model):
     def save(self, *args, **kwargs):
         """
         Create a unique slug from title - append an index and increment if it
-        already exists.
+        already exists. The entry count is only saved with new forms.
         """
         if not self.slug:
             slug = slugify(self)
             self.slug = unique_slug(self.__class__.objects, "slug", slug)
+        self.version = uuid4().hex
+        if not self._state.adding and not (args or kwargs):
+            # Leave the entry count to the UPDATE queries that maintain
+            # it, rather than overwriting it with the loaded value.
+            kwargs["update_fields"] = [f.name for f in
+                                       self._meta.concrete_fields
+                                       if not f.primary_key
+                                       and f.name != "entry_count"]
+        elif kwargs.get("update_fields"):
+            # Save the new version along with the fields given, so that
+            # cached pages of the form are replaced.
+            kwargs["update_fields"] = set(kwargs["update_fields"]) | {
+                "version"}
         super(AbstractForm, self).save(*args, **kwargs)
+        invalidate_forms_cache()
+
+    def bump_version(self):
+        """
+        Store a new version for the form without saving the rest of it,
+        so that any cached copies of the form's schema are discarded.
+        Called whenever one of the form's fields changes.
+        """
+        self.version = uuid4().hex
+        if self.pk is not None:
+            queryset = self.__class__.objects.filter(pk=self.pk)
+            queryset.update(version=self.version)
+        invalidate_forms_cache()
 
     def published(self, for_user=None):
         """
@@ -128,15 +280,47 @@ class AbstractForm(models.Model):
             # Django 1.8 compatibility, is_authenticated has to be called as a method.
             authenticated = for_user is not None and for_user.is_authenticated()
         login_required = (not self.login_required or authenticated)
-        return status and publish_date and expiry_date and login_required
+        return (status and publish_date and expiry_date and login_required
+                and not self.is_full())
+
+    def is_full(self):
+        """
+        Returns ``True`` if the form has a maximum number of entries,
+        and has received them, according to the loaded entry count.
+        """
+        return (self.max_entries is not None and
+                self.entry_count >= self.max_entries)
+
+    def increment_entries(self):
+        """
+        Count a new entry against the form, with a single UPDATE that
+        only succeeds while the form has room for more entries, so that
+        ``max_entries`` is never exceeded by concurrent submissions.
+        Returns ``False`` if the form is full.
+        """
+        queryset = self.__class__.objects.filter(pk=self.pk)
+        if self.max_entries is not None:
+            max_entries = models.F("max_entries")
+            queryset = queryset.filter(entry_count__lt=max_entries)
+        if not queryset.update(entry_count=models.F("entry_count") + 1):
+            invalidate_forms_cache()
+            return False
+        self.entry_count += 1
+        if self.max_entries is not None:
+            # Read back the count only for limited forms, to close the
+            # form as soon as its last entry is received.
+            self.entry_count = self.__class__.objects.filter(pk=self.pk
+                ).values_list("entry_count", flat=True)[0]
+            if self.is_full():
+                invalidate_forms_cache()
+        return True
 
     def total_entries(self):
         """
-        Called by the admin list view where the queryset is annotated
-        with the number of entries.
+        Called by the admin list view to show the number of entries.
         """
-        return self.total_entries
-    total_entries.admin_order_field = "total_entries"
+        return self.entry_count
+    total_entries.admin_order_field = "entry_count"
 
     def get_absolute_url(self):
         return reverse("form_detail", kwargs={"slug": self.slug})
@@ -181,6 +365,7 @@ class AbstractField(models.Model):
             "itself contains commas, surround the option starting with the %s"
             "character and ending with the %s character." %
                 (settings.CHOICES_QUOTE, settings.CHOICES_UNQUOTE))
+    parsed_choices = models.TextField(null=True, editable=False)
     default = models.CharField(_("Default value"), blank=True,
         max_length=settings.FIELD_MAX_LENGTH)
     placeholder_text = models.CharField(_("Placeholder Text"), null=True,
@@ -197,29 +382,24 @@ class AbstractField(models.Model):
     def __str__(self):
         return str(self.label)
 
+    def save(self, *args, **kwargs):
+        """
+        Parse the choices once here, storing them as a list for reading
+        whenever the field is used.
+        """
+        self.parsed_choices = json.dumps(parse_choices(self.choices))
+        super(AbstractField, self).save(*args, **kwargs)
+
     def get_choices(self):
         """
-        Parse a comma separated choice string into a list of choices taking
-        into account quoted choices using the ``settings.CHOICES_QUOTE`` and
-        ``settings.CHOICES_UNQUOTE`` settings.
-        """
-        choice = ""
-        quoted = False
-        for char in self.choices:
-            if not quoted and char == settings.CHOICES_QUOTE:
-                quoted = True
-            elif quoted and char == settings.CHOICES_UNQUOTE:
-                quoted = False
-            elif char == "," and not quoted:
-                choice = choice.strip()
-                if choice:
-                    yield choice, choice
-                choice = ""
-            else:
-                choice += char
-        choice = choice.strip()
-        if choice:
-            yield choice, choice
+        Return the field's choices as pairs of value and label, from the
+        list parsed when the field was saved, otherwise parsing them now.
+        """
+        if self.parsed_choices is None:
+            choices = parse_choices(self.choices)
+        else:
+            choices = json.loads(self.parsed_choices)
+        return [(choice, choice) for choice in choices]
 
     def is_a(self, *args):
         """
@@ -228,25 +408,121 @@ class AbstractField(models.Model):
         return self.field_type in args
 
 
+def fast_delete(queryset, ignore=()):
+    """
+    Delete the queryset with a single query when nothing else needs
+    to happen as its objects are deleted, namely when no delete signals
+    are connected for its model and no other models relate to it, other
+    than those in ``ignore`` whose related objects have already been
+    deleted. Otherwise use ``delete``, which collects the objects and
+    their related objects first.
+    """
+    model = queryset.model
+    collect = (pre_delete.has_listeners(model) or
+               post_delete.has_listeners(model) or
+               model._meta.many_to_many or
+               not hasattr(queryset, "_raw_delete"))
+    if not collect:
+        related = [rel for rel in model._meta.related_objects
+                   if rel.related_model not in ignore]
+        collect = len(related) > 0
+    if collect:
+        queryset.delete()
+    else:
+        queryset._raw_delete(queryset.db)
+
+
+class FormEntryQuerySet(models.QuerySet):
+
+    def delete_in_batches(self, batch_size=None, progress=None):
+        """
+        Delete the entries and their field entries in batches of
+        ``settings.DELETE_BATCH_SIZE`` entries, read by ID, with each
+        batch deleted in its own transaction. Unlike ``delete``, this
+        never holds more than a batch of entries in memory, nor locks
+        them all in a single transaction. The entry counts of their
+        forms are kept up to date, and ``progress`` is called with the
+        number of entries deleted so far after each batch. Returns the
+        number of entries deleted.
+        """
+        if batch_size is None:
+            batch_size = settings.DELETE_BATCH_SIZE
+        field_entry_model = self.model._meta.get_field("fields").related_model
+        form_model = self.model._meta.get_field("form").related_model
+        entries = self.order_by("id")
+        deleted = 0
+        last_id = 0
+        while True:
+            ids = list(entries.filter(id__gt=last_id).values_list("id",
+                flat=True)[:batch_size])
+            if not ids:
+                break
+            last_id = ids[-1]
+            batch = self.model.objects.filter(id__in=ids)
+            with transaction.atomic():
+                counts = batch.values_list("form_id").annotate(
+                    count=models.Count("id")).order_by()
+                counts = list(counts)
+                fast_delete(field_entry_model.objects.filter(entry_id__in=ids))
+                fast_delete(batch, ignore=(field_entry_model,))
+                for form_id, count in counts:
+                    form_model.objects.filter(id=form_id).update(
+                        entry_count=models.F("entry_count") - count)
+            deleted += len(ids)
+            if progress is not None:
+                progress(deleted)
+        if deleted:
+            # Forms that were full may be open again.
+            invalidate_forms_cache()
+        return deleted
+
+
 class AbstractFormEntry(models.Model):
     """
     An entry submitted via a user-built form.
     """
 
     entry_time = models.DateTimeField(_("Date/time"))
+    snapshot = models.TextField(_("Snapshot"), null=True, blank=True,
+        editable=False)
+
+    objects = FormEntryQuerySet.as_manager()
 
     class Meta:
         verbose_name = _("Form entry")
         verbose_name_plural = _("Form entries")
         abstract = True
 
+    def get_snapshot(self):
+        """
+        Returns the entry's field values as a dict mapping field IDs to
+        values, as denormalized from its field entries when the entry
+        was saved, or ``None`` if the entry has no snapshot yet.
+        """
+        if self.snapshot is None:
+            return None
+        values = json.loads(self.snapshot)
+        return dict((int(field_id), values[field_id]) for field_id in values)
+
+    def set_snapshot(self, values):
+        """
+        Stores the given dict mapping field IDs to values as the entry's
+        snapshot, with values as the field entries store them.
+        """
+        snapshot = {}
+        for field_id, value in values.items():
+            if value is not None:
+                value = str(value)
+            snapshot[str(field_id)] = value
+        self.snapshot = json.dumps(snapshot, sort_keys=True)
+
 
 class AbstractFieldEntry(models.Model):
     """
     A single field value for a form entry submitted via a user-built form.
     """
 
-    field_id = models.IntegerField()
+    field_id = models.IntegerField(db_index=True)
     value = models.CharField(max_length=settings.FIELD_MAX_LENGTH,
             null=True)
 
@@ -265,15 +541,34 @@ class AbstractFieldEntry(models.Model):
 class FormEntry(AbstractFormEntry):
     form = models.ForeignKey("Form", related_name="entries", on_delete=models.CASCADE)
 
+    class Meta(AbstractFormEntry.Meta):
+        # For filtering a form's entries by date, and paging through
+        # them in order.
+        index_together = (("form", "entry_time"), ("form", "id"))
+
 
 class FieldEntry(AbstractFieldEntry):
     entry = models.ForeignKey("FormEntry", related_name="fields", on_delete=models.CASCADE)
 
+    class Meta(AbstractFieldEntry.Meta):
+        # For looking up an entry's value for a field.
+        index_together = (("entry", "field_id"),)
+
 
 class Form(AbstractForm):
     pass
 
 
+@receiver(post_delete, sender=Form)
+@receiver(m2m_changed, sender=Form.sites.through)
+def form_changed(sender, **kwargs):
+    """
+    Discard cached forms when a form is deleted or its sites change,
+    neither of which go through ``AbstractForm.save``.
+    """
+    invalidate_forms_cache()
+
+
 class Field(AbstractField):
     """
     Implements automated field ordering.
@@ -292,8 +587,207 @@ class Field(AbstractField):
             slug = slugify(self).replace('-', '_')
             self.slug = unique_slug(self.form.fields, "slug", slug)
         super(Field, self).save(*args, **kwargs)
+        self.form.bump_version()
 
     def delete(self, *args, **kwargs):
         fields_after = self.form.fields.filter(order__gte=self.order)
         fields_after.update(order=models.F("order") - 1)
         super(Field, self).delete(*args, **kwargs)
+        self.form.bump_version()
+
+
+class QueuedEmailManager(models.Manager):
+    """
+    Adds emails to the outbox, and sends them from it.
+    """
+
+    def queue_mail_template(self, subject, template, addr_from,
+                            recipient_list, attachments=None, context=None,
+                            headers=None):
+        """
+        Mimics ``email_extras.utils.send_mail_template``, rendering the
+        templates and storing the email for sending by the
+        ``send_queued_emails`` command. Attachments are given as the
+        names of uploaded files, which are read when the email is sent.
+        """
+        if context is None:
+            context = {}
+        if not isinstance(recipient_list, (list, tuple)):
+            recipient_list = [recipient_list]
+        def render(ext):
+            name = "email_extras/%s.%s" % (template, ext)
+            return loader.get_template(name).render(context)
+        return self.create(subject=subject, from_email=addr_from,
+                           recipients=",".join(recipient_list),
+                           body_text=render("txt"), body_html=render("html"),
+                           attachments=json.dumps(attachments or []),
+                           headers=json.dumps(headers or {}),
+                           next_attempt=now())
+
+    def send_batch(self, batch_size):
+        """
+        Send the next batch of pending emails that are due, over a
+        single connection. Each email is claimed before sending by
+        moving its next attempt forward, so that several workers can
+        run at once without sending the same email twice. Returns the
+        number of emails claimed.
+        """
+        pending = self.filter(status=EMAIL_STATUS_PENDING,
+                              next_attempt__lte=now())
+        emails = []
+        for email in pending.order_by("next_attempt")[:batch_size]:
+            claimed = self.filter(id=email.id, next_attempt=email.next_attempt)
+            email.next_attempt = now() + timedelta(
+                seconds=settings.EMAIL_RETRY_DELAY)
+            if claimed.update(next_attempt=email.next_attempt):
+                emails.append(email)
+        if emails:
+            connection = get_connection()
+            try:
+                connection.open()
+            except Exception:
+                # Each send will try to connect again, and record the
+                # error against the email for retrying.
+                pass
+            try:
+                for email in emails:
+                    email.send(connection=connection)
+            finally:
+                connection.close()
+        return len(emails)
+
+
+@python_2_unicode_compatible
+class QueuedEmail(models.Model):
+    """
+    An email notification for a form entry, waiting in the outbox to be
+    sent by the ``send_queued_emails`` command.
+    """
+
+    subject = models.CharField(_("Subject"), max_length=255)
+    from_email = models.CharField(_("From address"), max_length=254)
+    recipients = models.TextField(_("Recipients"))
+    body_text = models.TextField()
+    body_html = models.TextField()
+    attachments = models.TextField(default="[]")
+    headers = models.TextField(default="{}")
+    status = models.IntegerField(_("Status"), choices=EMAIL_STATUS_CHOICES,
+        default=EMAIL_STATUS_PENDING)
+    attempts = models.IntegerField(_("Attempts"), default=0)
+    next_attempt = models.DateTimeField(_("Next attempt"), db_index=True)
+    sent_time = models.DateTimeField(_("Sent at"), null=True, blank=True)
+    last_error = models.TextField(_("Last error"), blank=True)
+
+    objects = QueuedEmailManager()
+
+    class Meta:
+        verbose_name = _("Queued email")
+        verbose_name_plural = _("Queued emails")
+
+    def __str__(self):
+        return str(self.subject)
+
+    def send(self, connection=None):
+        """
+        Send the email, recording whether it was delivered. Failed
+        sends are retried with an exponential backoff, until
+        ``settings.EMAIL_MAX_ATTEMPTS`` is reached.
+        """
+        from forms_builder.forms.forms import fs
+        self.attempts += 1
+        try:
+            attachments = []
+            for name in json.loads(self.attachments):
+                with fs.open(name) as f:
+                    attachments.append((basename(name), f.read()))
+            send_mail(self.subject, self.body_text, self.from_email,
+                      self.recipients.split(","), attachments=attachments,
+                      html_message=self.body_html, connection=connection,
+                      headers=json.loads(self.headers) or None)
+        except Exception as e:
+            self.last_error = str(e)
+            if self.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                self.status = EMAIL_STATUS_FAILED
+            else:
+                delay = settings.EMAIL_RETRY_DELAY * 2 ** (self.attempts - 1)
+                self.next_attempt = now() + timedelta(seconds=delay)
+        else:
+            self.status = EMAIL_STATUS_SENT
+            self.sent_time = now()
+        self.save()
+
+
+class EntryDeletionManager(models.Manager):
+
+    def run_next(self, batch_size=None):
+        """
+        Run the oldest pending deletion, claiming it first so that
+        several workers can run at once without running the same
+        deletion twice. Returns the deletion, or ``None`` if there are
+        no pending deletions.
+        """
+        pending = self.filter(status=DELETION_STATUS_PENDING)
+        for deletion in pending.order_by("id"):
+            claimed = pending.filter(id=deletion.id)
+            if claimed.update(status=DELETION_STATUS_RUNNING):
+                deletion.status = DELETION_STATUS_RUNNING
+                deletion.run(batch_size)
+                return deletion
+        return None
+
+
+@python_2_unicode_compatible
+class EntryDeletion(models.Model):
+    """
+    A deletion of the entries of a form that match the given filters,
+    too many to delete during a request, run in the background by the
+    ``delete_entries`` command.
+    """
+
+    form = models.ForeignKey("Form", related_name="deletions",
+        on_delete=models.CASCADE)
+    filters = models.TextField(default="{}")
+    status = models.IntegerField(_("Status"),
+        choices=DELETION_STATUS_CHOICES, default=DELETION_STATUS_PENDING)
+    total = models.IntegerField(_("Entries"), default=0)
+    deleted = models.IntegerField(_("Deleted"), default=0)
+    created = models.DateTimeField(_("Created"), default=now)
+    finished = models.DateTimeField(_("Finished"), null=True, blank=True)
+    last_error = models.TextField(_("Last error"), blank=True)
+
+    objects = EntryDeletionManager()
+
+    class Meta:
+        verbose_name = _("Entry deletion")
+        verbose_name_plural = _("Entry deletions")
+
+    def __str__(self):
+        return str(self.form)
+
+    def run(self, batch_size=None):
+        """
+        Delete the entries matching the filters in batches, recording
+        the number deleted after each batch.
+        """
+        from forms_builder.forms.forms import EntriesForm
+        data = MultiValueDict(json.loads(self.filters))
+        entries_form = EntriesForm(self.form, None, data=data)
+        entries_form.is_valid()
+        deletions = EntryDeletion.objects.filter(id=self.id)
+        def progress(deleted):
+            self.deleted = deleted
+            deletions.update(deleted=deleted)
+        try:
+            entries = entries_form.entries()
+            # Filters checked against each row may match fewer entries
+            # than were counted when the deletion was requested.
+            self.total = entries.count()
+            deletions.update(total=self.total)
+            entries.delete_in_batches(batch_size, progress)
+        except Exception as e:
+            self.status = DELETION_STATUS_FAILED
+            self.last_error = str(e)
+        else:
+            self.status = DELETION_STATUS_DONE
+        self.finished = now()
+        self.save()
@@ -54,3 +54,87 @@ EMAIL_FAIL_SILENTLY = getattr(settings, "FORMS_BUILDER_EMAIL_FAIL_SILENTLY",
 
 # Django SITE_ID - need a default since no longer provided in settings.py.
 SITE_ID = getattr(settings, "SITE_ID", 1)
+
+# Alias of the Django cache used for caching compiled forms.
+CACHE_ALIAS = getattr(settings, "FORMS_BUILDER_CACHE_ALIAS", "default")
+
+# Number of compiled form schemas held in memory by each process.
+SCHEMA_CACHE_SIZE = getattr(settings, "FORMS_BUILDER_SCHEMA_CACHE_SIZE", 100)
+
+# Seconds to cache the HTML of unbound forms rendered by the
+# render_built_form template tag, or None to not cache them.
+FRAGMENT_CACHE_TIMEOUT = getattr(settings,
+    "FORMS_BUILDER_FRAGMENT_CACHE_TIMEOUT", None)
+
+# Seconds to cache the form and form sent pages shown to anonymous
+# users, or None to not cache them.
+PAGE_CACHE_TIMEOUT = getattr(settings, "FORMS_BUILDER_PAGE_CACHE_TIMEOUT",
+    None)
+
+# Dotted path to a function called with the name, form ID, duration and
+# query count of each timed stage of handling forms, such as
+# "forms_builder.forms.metrics.log_metrics", or None to not time them.
+METRICS_BACKEND = getattr(settings, "FORMS_BUILDER_METRICS_BACKEND", None)
+
+# Number of field entries fetched from the database at a time when
+# exporting or viewing form entries.
+EXPORT_CHUNK_SIZE = getattr(settings, "FORMS_BUILDER_EXPORT_CHUNK_SIZE", 2000)
+
+# Number of entries deleted in each transaction when deleting entries
+# in the admin, along with their field entries.
+DELETE_BATCH_SIZE = getattr(settings, "FORMS_BUILDER_DELETE_BATCH_SIZE", 1000)
+
+# Number of entries above which deleting all entries matching the filters
+# in the admin is left to the delete_entries command, or None to always
+# delete them during the request.
+DELETE_IN_BACKGROUND = getattr(settings, "FORMS_BUILDER_DELETE_IN_BACKGROUND",
+    None)
+
+# Dotted path to the storage class that the archive_entries command
+# writes archives of old entries to, or None for DEFAULT_FILE_STORAGE.
+ARCHIVE_STORAGE = getattr(settings, "FORMS_BUILDER_ARCHIVE_STORAGE", None)
+
+# Number of times a visitor can submit a form with a throttle rate in
+# quick succession, before being limited to the form's rate.
+THROTTLE_BURST = getattr(settings, "FORMS_BUILDER_THROTTLE_BURST", 5)
+
+# Sequence of what identifies each visitor when throttling submissions,
+# containing "ip" for the client IP address and/or "session" for the
+# session, falling back to the IP address for visitors without one.
+THROTTLE_BY = getattr(settings, "FORMS_BUILDER_THROTTLE_BY", ("ip",))
+
+# Seconds that the response to a submission is kept for, and returned
+# again for repeated submissions with the same Idempotency-Key header or
+# submission token, rather than saving them again, or None to disable.
+IDEMPOTENCY_TIMEOUT = getattr(settings, "FORMS_BUILDER_IDEMPOTENCY_TIMEOUT",
+    None)
+
+# Number of entries shown per page when viewing form entries in the admin.
+ENTRIES_PER_PAGE = getattr(settings, "FORMS_BUILDER_ENTRIES_PER_PAGE", 100)
+
+# Boolean controlling whether form emails are added to an outbox and sent
+# by the send_queued_emails command, rather than sent during the request.
+EMAIL_OUTBOX = getattr(settings, "FORMS_BUILDER_EMAIL_OUTBOX", False)
+
+# Number of times sending a queued email is attempted before giving up.
+EMAIL_MAX_ATTEMPTS = getattr(settings, "FORMS_BUILDER_EMAIL_MAX_ATTEMPTS", 5)
+
+# Seconds to wait before retrying a queued email, doubled on each attempt.
+EMAIL_RETRY_DELAY = getattr(settings, "FORMS_BUILDER_EMAIL_RETRY_DELAY", 60)
+
+# Header used to hand off downloads of uploaded files to the web server,
+# either "X-Sendfile" (Apache, lighttpd) or "X-Accel-Redirect" (nginx).
+SENDFILE_HEADER = getattr(settings, "FORMS_BUILDER_SENDFILE_HEADER", None)
+
+# URL of the internal location that serves FORMS_BUILDER_UPLOAD_ROOT,
+# used with the X-Accel-Redirect header.
+SENDFILE_URL = getattr(settings, "FORMS_BUILDER_SENDFILE_URL", None)
+
+if SENDFILE_HEADER == "X-Accel-Redirect" and not SENDFILE_URL:
+    raise ImproperlyConfigured("FORMS_BUILDER_SENDFILE_URL is required "
+                               "when using X-Accel-Redirect")
+
+# Size in bytes above which uploaded files aren't attached to emails,
+# which instead contain a link to download the file from the admin.
+EMAIL_ATTACHMENT_MAX_SIZE = getattr(settings,
+    "FORMS_BUILDER_EMAIL_ATTACHMENT_MAX_SIZE", None)
@@ -4,3 +4,5 @@ from django.dispatch import Signal
 
 form_invalid = Signal(providing_args=["form"])
 form_valid = Signal(providing_args=["form", "entry"])
+stage_timed = Signal(providing_args=["stage", "form_id", "duration",
+                                     "queries"])
@@ -1,11 +1,20 @@
 from __future__ import unicode_literals
 from future.builtins import str
 
+from uuid import uuid4
+
+from django import VERSION as DJANGO_VERSION
 from django import template
+from django.core.cache import caches
 from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 
-from forms_builder.forms.forms import FormForForm
+from forms_builder.forms import settings
+from forms_builder.forms.forms import FormForForm, FormSchema
 from forms_builder.forms.models import Form, AbstractForm
+from forms_builder.forms.utils import CSRF_TOKEN_MARKER, now
+from forms_builder.forms.utils import SUBMISSION_TOKEN_MARKER
 
 
 register = template.Library()
@@ -33,12 +42,58 @@ class BuiltFormNode(template.Node):
         if (not issubclass(form.__class__, AbstractForm)
                 or not form.published(for_user=user)):
             return ""
+        if post or files:
+            # Bound forms show the submitted data and errors.
+            return self.render_form(context, form, post, files)
+        key = self.cache_key(context, form, user)
+        if key is None:
+            return self.render_form(context, form)
+        cache = caches[settings.CACHE_ALIAS]
+        html = cache.get(key)
+        if html is None:
+            with context.push(csrf_token=CSRF_TOKEN_MARKER):
+                html = self.render_form(context, form)
+            cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+        csrf_token = str(context["csrf_token"])
+        if csrf_token != CSRF_TOKEN_MARKER:
+            # The markers are left in place when rendering a page for
+            # the page cache, which fills them in for each request.
+            html = html.replace(CSRF_TOKEN_MARKER, csrf_token)
+            html = html.replace(SUBMISSION_TOKEN_MARKER, uuid4().hex)
+        return mark_safe(html)
+
+    def render_form(self, context, form, post=None, files=None):
         t = get_template("forms/includes/built_form.html")
         context["form"] = form
         form_args = (form, context, post or None, files or None)
         context["form_for_form"] = FormForForm(*form_args)
         return t.render(context.flatten())
 
+    def cache_key(self, context, form, user):
+        """
+        Returns the key for caching the form's rendered HTML, or
+        ``None`` if it can't be cached, when caching isn't enabled,
+        there's no CSRF token to add to each response, or the form has
+        template defaults that can differ for each request.
+        """
+        if (settings.FRAGMENT_CACHE_TIMEOUT is None
+                or not context.get("csrf_token")
+                or FormSchema.for_form(form).templates):
+            return None
+        authenticated = user is not None and user.is_authenticated
+        if DJANGO_VERSION < (1, 10):
+            # Django 1.8 compatibility, is_authenticated has to be called as a method.
+            authenticated = user is not None and user.is_authenticated()
+        if not authenticated:
+            visibility = "anonymous"
+        elif user.is_staff:
+            visibility = "staff"
+        else:
+            visibility = "user"
+        # Date of birth fields list the years up to the current one.
+        return "forms_builder.fragment.%s.%s.%s.%s.%s" % (form.id,
+            form.version, get_language(), visibility, now().year)
+
 
 @register.tag
 def render_built_form(parser, token):
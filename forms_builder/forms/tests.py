@@ -1,19 +1,52 @@
 from __future__ import unicode_literals
 
+import json
+import os
+from datetime import timedelta
+from io import BytesIO, StringIO
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import skipUnless
+from zipfile import ZipFile
+
 from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth.models import User, AnonymousUser
 from django.contrib.sites.models import Site
-from django.db import IntegrityError
+from django.core import mail
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
 from django.http import HttpResponse, HttpResponseRedirect
 from django.template import Context, RequestContext, Template
-from django.test import TestCase
+from django.test import Client, RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+try:
+    from django.urls import reverse
+except ImportError:
+    # For Django 1.8 compatibility
+    from django.core.urlresolvers import reverse
 
-from forms_builder.forms.fields import NAMES, FILE, SELECT
-from forms_builder.forms.forms import FormForForm
-from forms_builder.forms.models import (Form, Field,
-                                        STATUS_DRAFT, STATUS_PUBLISHED)
+from forms_builder.forms import admin as forms_admin, benchmarks, forms
+from forms_builder.forms import models, views
+from forms_builder.forms.management.commands import prewarm_form_pages
+from forms_builder.forms.fields import NAMES, FILE, SELECT, CHECKBOX_MULTIPLE
+from forms_builder.forms.fields import CHECKBOX, DATE, EMAIL
+from forms_builder.forms.forms import EntriesForm, FormForForm
+from forms_builder.forms.forms import (FILTER_CHOICE_CONTAINS,
+                                       FILTER_CHOICE_CONTAINS_ANY,
+                                       FILTER_CHOICE_EQUALS)
+from forms_builder.forms.models import (Form, Field, FormEntry, FieldEntry,
+                                        QueuedEmail,
+                                        STATUS_DRAFT, STATUS_PUBLISHED,
+                                        EMAIL_STATUS_SENT)
+from forms_builder.forms import settings as forms_settings
 from forms_builder.forms.settings import USE_SITES
-from forms_builder.forms.signals import form_invalid, form_valid
+from forms_builder.forms.signals import form_invalid, form_valid, stage_timed
+from forms_builder.forms.utils import now
 
 
 class Tests(TestCase):
@@ -94,6 +127,199 @@ class Tests(TestCase):
             t = Template(template % format).render(context)
             self.assertTrue(form.get_absolute_url(), t)
 
+    def test_tag_cache(self):
+        """
+        Test that unbound forms rendered by ``render_built_form`` are
+        cached when enabled, with the CSRF token for each request.
+        """
+        form = Form.objects.create(title="Tags", status=STATUS_PUBLISHED)
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        request = RequestFactory().get("/")
+        request.user = AnonymousUser()
+        template = Template("{% load forms_builder_tags %}"
+                            "{% render_built_form form %}")
+        render = lambda csrf_token: template.render(Context({
+            "request": request, "form": form, "csrf_token": csrf_token}))
+        timeout = forms_settings.FRAGMENT_CACHE_TIMEOUT
+        forms_settings.FRAGMENT_CACHE_TIMEOUT = 60
+        try:
+            self.assertTrue("first-token" in render("first-token"))
+            with self.assertNumQueries(0):
+                html = render("second-token")
+            self.assertTrue("second-token" in html)
+            self.assertFalse("first-token" in html)
+            form.fields.create(label="Email", field_type=EMAIL)
+            self.assertTrue('name="email"' in render("third-token"))
+            request = RequestFactory().post("/", {"name": ""})
+            request.user = AnonymousUser()
+            self.assertTrue("errorlist" in render("fourth-token"))
+        finally:
+            forms_settings.FRAGMENT_CACHE_TIMEOUT = timeout
+
+    def test_form_version(self):
+        """
+        Test that saving a form changes its version, including when
+        only some of its fields are saved.
+        """
+        form = Form.objects.create(title="Test")
+        version = form.version
+        form.title = "Changed"
+        form.save(update_fields=["title"])
+        saved = Form.objects.get(id=form.id)
+        self.assertEqual(saved.title, "Changed")
+        self.assertNotEqual(saved.version, version)
+        self.assertEqual(saved.version, form.version)
+
+    def test_page_cache(self):
+        """
+        Test that form pages are cached for anonymous users with the
+        CSRF token for each request, and change with the form.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        timeout = views.PAGE_CACHE_TIMEOUT
+        views.PAGE_CACHE_TIMEOUT = prewarm_form_pages.PAGE_CACHE_TIMEOUT = 60
+        try:
+            call_command("prewarm_form_pages")
+            request = RequestFactory().get("/")
+            request.user = AnonymousUser()
+            key = views.page_cache_key(request, form,
+                                       views.FormDetail.template_name)
+            cache = caches[forms_settings.CACHE_ALIAS]
+            self.assertTrue(b"FORMS_BUILDER_CSRF_TOKEN" in cache.get(key)[0])
+            with self.assertNumQueries(0):
+                response = self.client.get(form.get_absolute_url())
+            self.assertTrue(b'name="name"' in response.content)
+            self.assertTrue(b"csrfmiddlewaretoken" in response.content)
+            self.assertFalse(b"FORMS_BUILDER_CSRF_TOKEN" in response.content)
+            form.fields.create(label="Email", field_type=EMAIL)
+            response = self.client.get(form.get_absolute_url())
+            self.assertTrue(b'name="email"' in response.content)
+            form.status = STATUS_DRAFT
+            form.save()
+            response = self.client.get(form.get_absolute_url())
+            self.assertEqual(response.status_code, 404)
+        finally:
+            views.PAGE_CACHE_TIMEOUT = timeout
+            prewarm_form_pages.PAGE_CACHE_TIMEOUT = timeout
+
+    def test_idempotency(self):
+        """
+        Test that repeated submissions with the same submission token
+        or Idempotency-Key header return the first response, without
+        saving another entry or sending emails again.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   email_copies="a@b.com")
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        url = form.get_absolute_url()
+        self.assertNotContains(self.client.get(url), "submission_token")
+        timeout = views.PAGE_CACHE_TIMEOUT
+        views.PAGE_CACHE_TIMEOUT = 60
+        views.IDEMPOTENCY_TIMEOUT = 60
+        forms_settings.IDEMPOTENCY_TIMEOUT = 60
+        try:
+            pages = [self.client.get(url).content for i in range(2)]
+            views.PAGE_CACHE_TIMEOUT = timeout
+            tokens = [page.split(b'name="submission_token" value="')[1][:32]
+                      for page in pages]
+            self.assertNotEqual(tokens[0], tokens[1])
+            self.assertFalse(b"FORMS_BUILDER_SUBMISSION_TOKEN" in pages[0])
+            token = tokens[0].decode()
+            response = self.client.post(url, {"submission_token": token})
+            self.assertContains(response, 'value="%s"' % token)
+            first = self.client.post(url, {"name": "foo",
+                                           "submission_token": token})
+            with self.assertNumQueries(0):
+                second = self.client.post(url, {"name": "foo",
+                                                "submission_token": token})
+            self.assertEqual(second.status_code, 302)
+            self.assertEqual(second["Location"], first["Location"])
+            self.assertEqual(second["Idempotent-Replayed"], "true")
+            changed = self.client.post(url, {"name": "baz",
+                                             "submission_token": token})
+            self.assertEqual(changed.status_code, 422)
+            ajax = {"HTTP_X_REQUESTED_WITH": "XMLHttpRequest",
+                    "HTTP_IDEMPOTENCY_KEY": "f81d4fae"}
+            first = self.client.post(url, {"name": "bar"}, **ajax)
+            second = self.client.post(url, {"name": "bar"}, **ajax)
+            self.assertEqual(second.content, first.content)
+        finally:
+            views.PAGE_CACHE_TIMEOUT = timeout
+            views.IDEMPOTENCY_TIMEOUT = None
+            forms_settings.IDEMPOTENCY_TIMEOUT = None
+        self.assertEqual(form.entries.count(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_idempotency_cached_pages(self):
+        """
+        Test that visitors served the same cached page, with both the
+        fragment and page caches enabled, get their own submission
+        tokens, so their submissions are all saved.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        url = form.get_absolute_url()
+        fragment_timeout = forms_settings.FRAGMENT_CACHE_TIMEOUT
+        page_timeout = views.PAGE_CACHE_TIMEOUT
+        forms_settings.FRAGMENT_CACHE_TIMEOUT = 60
+        views.PAGE_CACHE_TIMEOUT = 60
+        views.IDEMPOTENCY_TIMEOUT = 60
+        forms_settings.IDEMPOTENCY_TIMEOUT = 60
+        try:
+            for name in ("foo", "bar"):
+                client = Client()
+                page = client.get(url).content
+                self.assertFalse(b"FORMS_BUILDER_SUBMISSION_TOKEN" in page)
+                token = page.split(b'name="submission_token" value="')[1]
+                response = client.post(url, {"name": name,
+                    "submission_token": token[:32].decode()})
+                self.assertFalse(response.has_header("Idempotent-Replayed"))
+        finally:
+            forms_settings.FRAGMENT_CACHE_TIMEOUT = fragment_timeout
+            views.PAGE_CACHE_TIMEOUT = page_timeout
+            views.IDEMPOTENCY_TIMEOUT = None
+            forms_settings.IDEMPOTENCY_TIMEOUT = None
+        self.assertEqual(form.entries.count(), 2)
+
+    def test_throttle(self):
+        """
+        Test that each visitor's submissions are limited to the form's
+        throttle rate once the burst is used up, without reading the
+        form or writing entries.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   throttle_rate=2)
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        url = form.get_absolute_url()
+        burst = views.THROTTLE_BURST
+        views.THROTTLE_BURST = 1
+        try:
+            self.client.post(url, {"name": "foo"})
+            with self.assertNumQueries(0):
+                response = self.client.post(url, {"name": "bar"})
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "1800")
+            response = self.client.post(url, {"name": "bar"},
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+            self.assertEqual(response.status_code, 429)
+            self.assertTrue("__all__" in json.loads(response.content.decode()
+                                                    )["errors"])
+            response = self.client.post(url, {"name": "baz"},
+                                        REMOTE_ADDR="10.0.0.1")
+            self.assertEqual(response.status_code, 302)
+        finally:
+            views.THROTTLE_BURST = burst
+        self.assertEqual(form.entries.count(), 2)
+
     def test_optional_filefield(self):
         form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
         if USE_SITES:
@@ -134,6 +360,21 @@ class Tests(TestCase):
         field.save()
         self.assertLessEqual(len(field.slug), max_slug_length)
 
+    def test_field_choices(self):
+        """
+        Test that choices are parsed when a field is saved, including
+        quoted choices containing commas.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Choices", field_type=SELECT,
+                           choices="a, `b, c`, , d")
+        field = Field.objects.get(form=form)
+        choices = [("a", "a"), ("b, c", "b, c"), ("d", "d")]
+        with self.assertNumQueries(0):
+            self.assertEqual(field.get_choices(), choices)
+        field.parsed_choices = None
+        self.assertEqual(field.get_choices(), choices)
+
     def test_field_default_ordering(self):
         form = Form.objects.create(title="Test")
         form.fields.create(label="second field",
@@ -239,3 +480,656 @@ class Tests(TestCase):
                 <option value="two" selected>two</option>
                 <option value="three">three</option>
             </select>""", html=True)
+
+    def test_form_schema_cache(self):
+        """
+        Test that the compiled schema is reused between FormForForm
+        instances, and rebuilt when the form's fields change.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Foo", field_type=NAMES[0][0])
+        FormForForm(form, Context())
+        with self.assertNumQueries(0):
+            form_for_form = FormForForm(form, Context())
+        self.assertEqual(list(form_for_form.fields), ["foo"])
+        form.fields.create(label="Bar", field_type=NAMES[0][0])
+        form = Form.objects.get(id=form.id)
+        form_for_form = FormForForm(form, Context())
+        self.assertEqual(list(form_for_form.fields), ["foo", "bar"])
+
+    def test_field_defaults(self):
+        """
+        Test that literal and template defaults are both used as
+        initial values.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Literal", field_type=NAMES[0][0],
+                           default="plain text")
+        form.fields.create(label="Template", field_type=NAMES[0][0],
+                           default="{{ greeting }} world")
+        form.fields.create(label="Empty", field_type=NAMES[0][0])
+        form_for_form = FormForForm(form, Context({"greeting": "hello"}))
+        self.assertEqual(form_for_form.initial, {"literal": "plain text",
+                                                 "template": "hello world"})
+        form_for_form = FormForForm(form, Context({"greeting": "hi"}),
+                                    initial={"literal": "other"})
+        self.assertEqual(form_for_form.initial, {"literal": "other",
+                                                 "template": "hi world"})
+
+    def test_edit_entry(self):
+        """
+        Test that editing an entry updates and adds its field entries
+        with a constant number of queries, whatever the form's width.
+        """
+        counts = []
+        for num_fields in (2, 6):
+            form = Form.objects.create(title="Test %s" % num_fields)
+            for i in range(num_fields):
+                form.fields.create(label="Field %s" % i,
+                                   field_type=NAMES[0][0])
+            data = dict((f.slug, "old") for f in form.fields.all())
+            entry = FormForForm(form, Context(), data).save()
+            form.fields.create(label="Added", field_type=NAMES[0][0])
+            data = dict((f.slug, "new") for f in form.fields.all())
+            form_for_form = FormForForm(form, Context(), data,
+                                        instance=entry)
+            self.assertTrue(form_for_form.is_valid())
+            with CaptureQueriesContext(connection) as queries:
+                form_for_form.save()
+            counts.append(len(queries))
+            values = entry.fields.values_list("value", flat=True)
+            self.assertEqual(list(values), ["new"] * (num_fields + 1))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_edit_entry_values(self):
+        """
+        Test that edited checkbox and date values are stored as they
+        are for new entries, and shown when editing the entry again.
+        """
+        form = Form.objects.create(title="Test")
+        agree = form.fields.create(label="Agree", field_type=CHECKBOX,
+                                   required=False)
+        day = form.fields.create(label="Day", field_type=DATE)
+        data = {"agree": "on", "day": "2018-01-02"}
+        entry = FormForForm(form, Context(), data).save()
+        data = {"day": "2019-03-04"}
+        form_for_form = FormForForm(form, Context(), data, instance=entry)
+        self.assertTrue(form_for_form.is_valid())
+        form_for_form.save()
+        values = dict(entry.fields.values_list("field_id", "value"))
+        self.assertEqual(values, {agree.id: "False", day.id: "2019-03-04"})
+        form_for_form = FormForForm(form, Context(), instance=entry)
+        self.assertEqual(form_for_form.initial["agree"], False)
+        self.assertEqual(form_for_form.initial["day"], "2019-03-04")
+
+    def test_published_cache(self):
+        """
+        Test that published forms are cached by slug, and dropped from
+        the cache when changed or when their publish window closes.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        if USE_SITES:
+            form.sites.add(self._site)
+        Form.objects.get_published(form.slug)
+        with self.assertNumQueries(0):
+            self.assertEqual(Form.objects.get_published(form.slug), form)
+        form.status = STATUS_DRAFT
+        form.save()
+        with self.assertRaises(Form.DoesNotExist):
+            Form.objects.get_published(form.slug)
+        form.status = STATUS_PUBLISHED
+        form.expiry_date = now() + timedelta(seconds=1)
+        form.save()
+        self.assertEqual(Form.objects.get_published(form.slug), form)
+        later = now() + timedelta(seconds=2)
+        models.now = lambda: later
+        try:
+            with self.assertRaises(Form.DoesNotExist):
+                Form.objects.get_published(form.slug)
+        finally:
+            models.now = now
+
+    def test_max_entries(self):
+        """
+        Test that entries are counted against the form, which is closed
+        once it reaches its maximum number of entries.
+        """
+        settings.DEBUG = True # Don't depend on having a 404 template.
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED,
+                                   max_entries=2)
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        stale = Form.objects.get(id=form.id)
+        for name in ("foo", "bar"):
+            response = self.client.post(form.get_absolute_url(),
+                                        data={"name": name})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(Form.objects.get(id=form.id).entry_count, 2)
+        response = self.client.get(form.get_absolute_url())
+        self.assertEqual(response.status_code, 404)
+        form_for_form = FormForForm(stale, Context(), data={"name": "baz"})
+        self.assertTrue(form_for_form.is_valid())
+        self.assertRaises(ValidationError, form_for_form.save)
+        self.assertEqual(FormEntry.objects.count(), 2)
+        stale.title = "Changed"
+        stale.save()
+        self.assertEqual(Form.objects.get(id=form.id).entry_count, 2)
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        url = reverse("admin:form_entries", args=(form.id,))
+        entry = FormEntry.objects.first()
+        self.client.post(url, {"delete": "1", "selected": [entry.id]})
+        self.assertEqual(Form.objects.get(id=form.id).entry_count, 1)
+        response = self.client.get(form.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+
+    @skipUnless(connection.vendor == "sqlite", "Uses SQLite query plans")
+    def test_entry_indexes(self):
+        """
+        Test that the queries for reading a form's entries use indexes
+        rather than scanning whole tables.
+        """
+        form = Form.objects.create(title="Test")
+        entry = FormEntry.objects.create(form=form, entry_time=now())
+        entries = FormEntry.objects.filter(form=form)
+        field_entries = FieldEntry.objects.filter(entry__form=form)
+        # Each query along with the column constraint its index applies.
+        queries = (
+            (field_entries.order_by("-entry__id").select_related("entry"),
+             "(entry_id=?)"),
+            (entries.filter(entry_time__gte=now(), entry_time__lt=now()),
+             "entry_time>?"),
+            (entries.filter(id__lt=entry.id).order_by("-id"), " id<?"),
+            (entry.fields.filter(field_id=1), "field_id=?"),
+            (entries.filter(id__in=FieldEntry.objects.filter(
+                field_id=1, value="test").values("entry_id")), "(field_id=?)"),
+        )
+        for queryset, constraint in queries:
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+            message = "%s\n%s" % (sql, "\n".join(plan))
+            for step in plan:
+                scan = step.startswith("SCAN") and "USING" not in step
+                self.assertFalse(scan, message)
+            self.assertTrue([step for step in plan if "USING" in step
+                             and constraint in step], message)
+
+    def test_benchmarks(self):
+        """
+        Test that each benchmark runs and reports its measurements.
+        """
+        results = list(benchmarks.run([3], [2], num_forms=2, repeat=1))
+        names = set([result["name"] for result in results])
+        for name in ("published", "build", "validate", "save",
+                     "render_built_form", "rows", "export_csv"):
+            self.assertTrue(name in names)
+        for result in results:
+            self.assertTrue(result["time"] >= 0)
+            self.assertTrue(result["queries"] >= 0)
+
+    def test_stage_timed(self):
+        """
+        Test that each stage of a submission is timed when there's a
+        receiver for the timings.
+        """
+        form = Form.objects.create(title="Test", status=STATUS_PUBLISHED)
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        timings = []
+        def receiver(sender, **kwargs):
+            timings.append(kwargs)
+        stage_timed.connect(receiver)
+        try:
+            self.client.post(form.get_absolute_url(), {"name": "test"})
+            entries_form = EntriesForm(form, None)
+            list(entries_form.rows())
+        finally:
+            stage_timed.disconnect(receiver)
+        self.assertEqual([timing["stage"] for timing in timings],
+                         ["build", "validate", "save", "form_valid",
+                          "send_emails", "rows"])
+        for timing in timings:
+            self.assertEqual(timing["form_id"], form.id)
+            self.assertTrue(timing["duration"] >= 0)
+        self.assertTrue(timings[2]["queries"] > 0)
+
+    def test_stage_timed_page(self):
+        """
+        Test that reading rows for a page of entries, without reading
+        all of them, is still timed.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        for name in ("foo", "bar"):
+            FormForForm(form, Context(), {"name": name}).save()
+        timings = []
+        def receiver(sender, **kwargs):
+            timings.append(kwargs)
+        stage_timed.connect(receiver)
+        per_page = forms_admin.ENTRIES_PER_PAGE
+        forms_admin.ENTRIES_PER_PAGE = 1
+        try:
+            form_admin = admin.site._registry[Form]
+            page = form_admin.entries_page(EntriesForm(form, None))
+        finally:
+            forms_admin.ENTRIES_PER_PAGE = per_page
+            stage_timed.disconnect(receiver)
+        self.assertEqual(len(page["rows"]), 1)
+        self.assertEqual([timing["stage"] for timing in timings], ["rows"])
+
+    def test_import_entries(self):
+        """
+        Test that entries are imported in batches with their values
+        validated, and that interrupted imports can be resumed.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        form.fields.create(label="Email", field_type=EMAIL)
+        form.fields.create(label="Colours", field_type=CHECKBOX_MULTIPLE,
+                           choices="red, green, blue", required=False)
+        name, email, colours = form.fields.all()
+        temp_dir = mkdtemp()
+        try:
+            path = os.path.join(temp_dir, "entries.csv")
+            with open(path, "wb") as f:
+                f.write("name,email,colours,entry_time\n"
+                        "f\u00f6o,foo@example.com,\"red, blue\","
+                        "2018-01-02 10:00\n"
+                        "bar,invalid,,\n"
+                        "baz,baz@example.com,green,\n".encode("utf-8"))
+            with open(path + ".progress", "w") as f:
+                f.write("1")
+            call_command("import_entries", form.slug, path, resume=True,
+                         batch_size=1, verbosity=0, stderr=StringIO())
+            self.assertEqual(FormEntry.objects.count(), 1)
+            call_command("import_entries", str(form.id), path,
+                         batch_size=2, verbosity=0, stderr=StringIO())
+            self.assertFalse(os.path.exists(path + ".progress"))
+        finally:
+            rmtree(temp_dir)
+        self.assertEqual(Form.objects.get(id=form.id).entry_count, 3)
+        entry = FormEntry.objects.order_by("id")[1]
+        self.assertEqual(entry.entry_time.year, 2018)
+        self.assertEqual(entry.get_snapshot(), {name.id: "f\u00f6o",
+            email.id: "foo@example.com", colours.id: "red, blue"})
+        values = entry.fields.values_list("field_id", "value")
+        self.assertEqual(dict(values), entry.get_snapshot())
+
+    def test_archive_entries(self):
+        """
+        Test that entries past their form's retention period are
+        archived by month and deleted, and can be restored.
+        """
+        form = Form.objects.create(title="Test", retention_days=30)
+        name = form.fields.create(label="Name", field_type=NAMES[0][0])
+        for value in ("foo", "bar", "baz"):
+            form_for_form = FormForForm(form, Context(), data={"name": value})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        foo, bar, baz = FormEntry.objects.order_by("id")
+        FormEntry.objects.filter(id=foo.id).update(snapshot=None,
+            entry_time=foo.entry_time.replace(year=2018, month=1, day=5))
+        FormEntry.objects.filter(id=bar.id).update(
+            entry_time=bar.entry_time.replace(year=2018, month=2, day=5))
+        temp_dir = mkdtemp()
+        try:
+            with self.settings(MEDIA_ROOT=temp_dir):
+                call_command("archive_entries", verbosity=0)
+                self.assertEqual(list(FormEntry.objects.all()), [baz])
+                archives = os.path.join(temp_dir, "forms_builder",
+                                        "archives", form.slug)
+                self.assertEqual(sorted(os.listdir(archives)),
+                                 ["2018-01.jsonl.gz", "2018-02.jsonl.gz"])
+                call_command("restore_entries", form.slug,
+                             "forms_builder/archives/test/2018-01.jsonl.gz",
+                             verbosity=0)
+        finally:
+            rmtree(temp_dir)
+        self.assertEqual(Form.objects.get(id=form.id).entry_count, 2)
+        entry = FormEntry.objects.latest("id")
+        self.assertEqual(entry.entry_time, foo.entry_time.replace(
+            year=2018, month=1, day=5))
+        self.assertEqual(entry.get_snapshot(), {name.id: "foo"})
+
+    def test_csv_export(self):
+        """
+        Test that the CSV export is streamed with a row per entry.
+        """
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        for name in ("foo", "bar"):
+            form_for_form = FormForForm(form, Context(), data={"name": name})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        url = reverse("admin:form_entries_export", args=(form.id,))
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode("utf-8")
+        lines = lines.splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("bar,"))
+        self.assertTrue(lines[2].startswith("foo,"))
+
+    def test_entry_snapshots(self):
+        """
+        Test that entries store a snapshot of their values, which the
+        backfill command restores, and that rows are the same whether
+        they're built from snapshots or field entries.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        form.fields.create(label="Colours", field_type=CHECKBOX_MULTIPLE,
+                           choices="red, green, blue", required=False)
+        name, colours = form.fields.all()
+        for data in ({"name": "foo", "colours": ["red", "blue"]},
+                     {"name": "bar"}):
+            form_for_form = FormForForm(form, Context(), data=data)
+            self.assertTrue(form_for_form.is_valid())
+            entry = form_for_form.save()
+        self.assertEqual(entry.get_snapshot(), {name.id: "bar",
+                                                colours.id: ""})
+        data = {"field_%s_export" % name.id: "on",
+                "field_%s_export" % colours.id: "on"}
+        entries_form = EntriesForm(form, None, data=data)
+        self.assertTrue(entries_form.is_valid())
+        rows = list(entries_form.rows())
+        self.assertEqual([row[1:] for row in rows],
+                         [["bar", ""], ["foo", "red, blue"]])
+        snapshots = list(FormEntry.objects.values_list("snapshot", flat=True))
+        FormEntry.objects.update(snapshot=None)
+        self.assertEqual(list(entries_form.rows()), rows)
+        call_command("backfill_entry_snapshots")
+        self.assertEqual(
+            list(FormEntry.objects.values_list("snapshot", flat=True)),
+            snapshots)
+
+    def test_entries_filters(self):
+        """
+        Test that filters applied by the database and in Python both
+        filter the rows of entries.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        form.fields.create(label="Colours", field_type=CHECKBOX_MULTIPLE,
+                           choices="red, green, blue", required=False)
+        for name, colours in (("foo", ["red"]), ("bar", ["red", "blue"]),
+                              ("baz", [])):
+            data = {"name": name, "colours": colours}
+            form_for_form = FormForForm(form, Context(), data=data)
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        name, colours = form.fields.all()
+        data = {"field_%s_export" % name.id: "on",
+                "field_%s_filter" % name.id: FILTER_CHOICE_CONTAINS,
+                "field_%s_contains" % name.id: "BA"}
+        entries_form = EntriesForm(form, None, data=data)
+        self.assertTrue(entries_form.is_valid())
+        rows = [row[1:] for row in entries_form.rows()]
+        self.assertEqual(rows, [["baz"], ["bar"]])
+        data.update({"field_%s_filter" % colours.id: FILTER_CHOICE_CONTAINS_ANY,
+                     "field_%s_contains" % colours.id: ["blue"]})
+        entries_form = EntriesForm(form, None, data=data)
+        self.assertTrue(entries_form.is_valid())
+        rows = [row[1:] for row in entries_form.rows()]
+        self.assertEqual(rows, [["bar"]])
+
+    def test_entries_pages(self):
+        """
+        Test paging through entries in the admin with cursors, and
+        deleting all entries matching the filters across pages.
+        """
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        for i in range(5):
+            form_for_form = FormForForm(form, Context(), data={"name": i})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        ids = list(form.entries.order_by("-id").values_list("id", flat=True))
+        form_admin = admin.site._registry[Form]
+        entries_form = EntriesForm(form, None)
+        per_page = forms_admin.ENTRIES_PER_PAGE
+        forms_admin.ENTRIES_PER_PAGE = 2
+        try:
+            page = form_admin.entries_page(entries_form)
+            self.assertEqual([r[0] for r in page["rows"]], ids[:2])
+            self.assertEqual((page["previous"], page["next"]), (None, ids[1]))
+            page = form_admin.entries_page(entries_form, before=page["next"])
+            self.assertEqual([r[0] for r in page["rows"]], ids[2:4])
+            page = form_admin.entries_page(entries_form, before=page["next"])
+            self.assertEqual([r[0] for r in page["rows"]], ids[4:])
+            self.assertEqual((page["previous"], page["next"]), (ids[4], None))
+            page = form_admin.entries_page(entries_form, after=ids[4])
+            self.assertEqual([r[0] for r in page["rows"]], ids[2:4])
+        finally:
+            forms_admin.ENTRIES_PER_PAGE = per_page
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        url = reverse("admin:form_entries_show", args=(form.id,))
+        self.assertContains(self.client.get(url), 'name="selected" value=', 5)
+        name = form.fields.get()
+        url = reverse("admin:form_entries", args=(form.id,))
+        self.client.post(url, {"field_%s_filter" % name.id: FILTER_CHOICE_EQUALS,
+                               "field_%s_contains" % name.id: "3",
+                               "delete": "1", "select_all": "on"})
+        self.assertEqual(form.entries.count(), 4)
+
+    def test_delete_entries(self):
+        """
+        Test deleting entries in batches, and in the background via
+        the delete_entries command.
+        """
+        form = Form.objects.create(title="Test")
+        name = form.fields.create(label="Name", field_type=NAMES[0][0])
+        for value in ("first", "first", "first", "drop", "drop", "keep"):
+            form_for_form = FormForForm(form, Context(), data={"name": value})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        progress = []
+        deleted = form.entries.filter(fields__value="first"
+            ).delete_in_batches(batch_size=2, progress=progress.append)
+        self.assertEqual((deleted, progress), (3, [2, 3]))
+        self.assertEqual(form.entries.count(), 3)
+        self.assertEqual(FieldEntry.objects.count(), 3)
+        self.assertEqual(Form.objects.get(id=form.id).entry_count, 3)
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        url = reverse("admin:form_entries", args=(form.id,))
+        forms_admin.DELETE_IN_BACKGROUND = 1
+        try:
+            self.client.post(url, {
+                "field_%s_export" % name.id: "on",
+                "field_%s_filter" % name.id: FILTER_CHOICE_CONTAINS,
+                "field_%s_contains" % name.id: "drop",
+                "delete": "1", "select_all": "on"})
+        finally:
+            forms_admin.DELETE_IN_BACKGROUND = None
+        self.assertEqual(form.entries.count(), 3)
+        url = reverse("admin:form_entries_show", args=(form.id,))
+        self.assertContains(self.client.get(url), "0 of 2 deleted")
+        call_command("delete_entries")
+        self.assertEqual(list(FieldEntry.objects.values_list("value",
+                                                             flat=True)),
+                         ["keep"])
+        deletion = models.EntryDeletion.objects.get()
+        self.assertEqual((deletion.status, deletion.deleted),
+                         (models.DELETION_STATUS_DONE, 2))
+        self.assertEqual(Form.objects.get(id=form.id).entry_count, 1)
+        self.client.post(reverse("admin:forms_form_changelist"), {
+            "action": "delete_selected", "_selected_action": [form.id],
+            "post": "yes"})
+        self.assertFalse(Form.objects.exists())
+        self.assertFalse(FieldEntry.objects.exists())
+
+    def test_delete_entries_in_background(self):
+        """
+        Test that filters only checked against each row are left to
+        the background job when deleting entries in the background.
+        """
+        form = Form.objects.create(title="Test")
+        colours = form.fields.create(label="Colours",
+            field_type=CHECKBOX_MULTIPLE, choices="red, green, blue")
+        for value in (["red"], ["red", "blue"], ["blue"]):
+            form_for_form = FormForForm(form, Context(),
+                                        data={"colours": value})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        url = reverse("admin:form_entries", args=(form.id,))
+        def entries(*args, **kwargs):
+            raise AssertionError("Entries resolved during the request")
+        forms_admin.DELETE_IN_BACKGROUND = 1
+        EntriesForm.entries, original_entries = entries, EntriesForm.entries
+        try:
+            self.client.post(url, {
+                "field_%s_filter" % colours.id: FILTER_CHOICE_CONTAINS_ANY,
+                "field_%s_contains" % colours.id: "blue",
+                "delete": "1", "select_all": "on"})
+        finally:
+            forms_admin.DELETE_IN_BACKGROUND = None
+            EntriesForm.entries = original_entries
+        self.assertEqual(models.EntryDeletion.objects.get().total, 3)
+        call_command("delete_entries")
+        deletion = models.EntryDeletion.objects.get()
+        self.assertEqual((deletion.total, deletion.deleted), (2, 2))
+        self.assertEqual(list(FieldEntry.objects.values_list("value",
+                                                             flat=True)),
+                         ["red"])
+
+    def test_email_outbox(self):
+        """
+        Test that emails are queued when the outbox is enabled, and
+        sent by the send_queued_emails command.
+        """
+        form = Form.objects.create(title="Test", email_copies="a@b.com")
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="Email", field_type=EMAIL)
+        views.EMAIL_OUTBOX = True
+        try:
+            self.client.post(form.get_absolute_url(), {"email": "c@d.com"})
+        finally:
+            views.EMAIL_OUTBOX = False
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(QueuedEmail.objects.count(), 2)
+        call_command("send_queued_emails")
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(QueuedEmail.objects.filter(
+            status=EMAIL_STATUS_SENT).count(), 2)
+
+    @skipUnless(forms_admin.XLSXWRITER_INSTALLED, "xlsxwriter not installed")
+    def test_xlsx_export(self):
+        """
+        Test that the XLSX export contains a row per entry.
+        """
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="Name", field_type=NAMES[0][0])
+        form.fields.create(label="Date", field_type=DATE)
+        for name in ("foo", "bar"):
+            data = {"name": name, "date": "2018-01-02"}
+            form_for_form = FormForForm(form, Context(), data=data)
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        url = reverse("admin:form_entries", args=(form.id,))
+        data = dict([("field_%s_export" % f.id, "on")
+                     for f in form.fields.all()], export_xlsx="1")
+        data["field_0_export"] = "on"
+        response = self.client.post(url, data)
+        content = b"".join(response.streaming_content)
+        self.assertEqual(int(response["Content-Length"]), len(content))
+        sheet = ZipFile(BytesIO(content)).read("xl/worksheets/sheet1.xml")
+        self.assertEqual(sheet.count(b"<row "), 3)
+        # Dates are written as numbers with a date format.
+        self.assertEqual(sheet.count(b"<v>43102</v>"), 2)
+
+    @skipUnless(forms_admin.XLSXWRITER_INSTALLED, "xlsxwriter not installed")
+    def test_xlsx_export_text(self):
+        """
+        Test that submitted values that look like formulas or URLs are
+        exported as text.
+        """
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        form = Form.objects.create(title="Test")
+        name = form.fields.create(label="Name", field_type=NAMES[0][0])
+        for value in ("=1+2", "http://example.com"):
+            form_for_form = FormForForm(form, Context(), data={"name": value})
+            self.assertTrue(form_for_form.is_valid())
+            form_for_form.save()
+        url = reverse("admin:form_entries", args=(form.id,))
+        response = self.client.post(url, {"field_%s_export" % name.id: "on",
+                                          "export_xlsx": "1"})
+        content = ZipFile(BytesIO(b"".join(response.streaming_content)))
+        sheet = content.read("xl/worksheets/sheet1.xml")
+        self.assertFalse(b"<f>" in sheet)
+        self.assertFalse(b"<hyperlink" in sheet)
+        self.assertTrue(b"<t>=1+2</t>" in sheet)
+        self.assertTrue(b"<t>http://example.com</t>" in sheet)
+
+    def test_file_download(self):
+        """
+        Test that uploaded files are downloaded in full, or for the
+        byte range requested.
+        """
+        User.objects.create_superuser("test", "", "test")
+        self.client.login(username="test", password="test")
+        form = Form.objects.create(title="Test")
+        form.fields.create(label="File", field_type=FILE)
+        storage = FileSystemStorage(location=mkdtemp())
+        fs = forms.fs, forms_admin.fs
+        forms.fs = forms_admin.fs = storage
+        try:
+            files = {"file": SimpleUploadedFile("test.txt", b"0123456789")}
+            form_for_form = FormForForm(form, Context(), data={}, files=files)
+            self.assertTrue(form_for_form.is_valid())
+            entry = form_for_form.save()
+            url = reverse("admin:form_file", args=(entry.fields.get().id,))
+            response = self.client.get(url)
+            self.assertEqual(b"".join(response.streaming_content),
+                             b"0123456789")
+            response = self.client.get(url, HTTP_RANGE="bytes=2-4")
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response["Content-Range"], "bytes 2-4/10")
+            self.assertEqual(b"".join(response.streaming_content), b"234")
+            response = self.client.get(url, HTTP_RANGE="bytes=-3")
+            self.assertEqual(b"".join(response.streaming_content), b"789")
+            response = self.client.get(url, HTTP_RANGE="bytes=10-")
+            self.assertEqual(response.status_code, 416)
+        finally:
+            forms.fs, forms_admin.fs = fs
+            rmtree(storage.location)
+
+    def test_email_attachments(self):
+        """
+        Test that uploaded files are attached to emails, or linked to
+        when they're over the size limit.
+        """
+        form = Form.objects.create(title="Test", email_copies="a@b.com")
+        if USE_SITES:
+            form.sites.add(self._site)
+        form.fields.create(label="File", field_type=FILE)
+        storage = FileSystemStorage(location=mkdtemp())
+        fs = forms.fs, views.fs
+        forms.fs = views.fs = storage
+        try:
+            for max_size in (None, 5):
+                views.EMAIL_ATTACHMENT_MAX_SIZE = max_size
+                upload = SimpleUploadedFile("test.txt", b"0123456789")
+                self.client.post(form.get_absolute_url(), {"file": upload})
+        finally:
+            forms.fs, views.fs = fs
+            views.EMAIL_ATTACHMENT_MAX_SIZE = None
+            rmtree(storage.location)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].attachments,
+                         [("test.txt", "0123456789", "text/plain")])
+        self.assertEqual(mail.outbox[1].attachments, [])
+        self.assertTrue("/admin/forms/form/file/" in mail.outbox[1].body)
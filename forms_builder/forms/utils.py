@@ -1,9 +1,16 @@
 from __future__ import unicode_literals
 
-from django.template.defaultfilters import slugify as django_slugify
+import re
+from collections import OrderedDict
 from importlib import import_module
+from threading import Lock
+
+from django.core.files.storage import get_storage_class
+from django.template.defaultfilters import slugify as django_slugify
 from unidecode import unidecode
 
+from forms_builder.forms import settings
+
 
 # Timezone support with fallback.
 try:
@@ -13,6 +20,15 @@ except ImportError:
     now = datetime.now
 
 
+# Rendered in place of the CSRF token in cached HTML, and replaced with
+# the token for each request.
+CSRF_TOKEN_MARKER = "FORMS_BUILDER_CSRF_TOKEN"
+
+# Rendered in place of the submission token in cached HTML, and
+# replaced with a new token for each request.
+SUBMISSION_TOKEN_MARKER = "FORMS_BUILDER_SUBMISSION_TOKEN"
+
+
 def slugify(s):
     """
     Translates unicode into closest possible ascii chars before
@@ -50,6 +66,67 @@ def split_choices(choices_string):
     return [x.strip() for x in choices_string.split(",") if x.strip()]
 
 
+def parse_choices(choices_string):
+    """
+    Parse a comma separated choice string into a list of choices taking
+    into account quoted choices using the ``settings.CHOICES_QUOTE`` and
+    ``settings.CHOICES_UNQUOTE`` settings.
+    """
+    choices = []
+    choice = ""
+    quoted = False
+    for char in choices_string:
+        if not quoted and char == settings.CHOICES_QUOTE:
+            quoted = True
+        elif quoted and char == settings.CHOICES_UNQUOTE:
+            quoted = False
+        elif char == "," and not quoted:
+            choice = choice.strip()
+            if choice:
+                choices.append(choice)
+            choice = ""
+        else:
+            choice += char
+    choice = choice.strip()
+    if choice:
+        choices.append(choice)
+    return choices
+
+
+def is_template(value):
+    """
+    Return True if the given string contains Django template syntax
+    and needs to be rendered, rather than used as is.
+    """
+    return "{{" in value or "{%" in value or "{#" in value
+
+
+def parse_range(header, size):
+    """
+    Parse the value of an HTTP Range header for a file of the given
+    size, returning the positions of the first and last bytes in the
+    range. Returns None if the header isn't a single byte range, in
+    which case the whole file should be sent, and raises ValueError
+    if the range is outside of the file.
+    """
+    match = re.match(r"^bytes=(\d*)-(\d*)$", header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    start, end = match.groups()
+    if not start:
+        # A suffix range, for the last bytes of the file.
+        if not int(end):
+            raise ValueError("Empty suffix range")
+        return max(size - int(end), 0), size - 1
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise ValueError("Range starts after the end of the file")
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
 def html5_field(name, base):
     """
     Takes a Django form field class and returns a subclass of
@@ -65,3 +142,42 @@ def import_attr(path):
     """
     module_path, attr_name = path.rsplit(".", 1)
     return getattr(import_module(module_path), attr_name)
+
+
+def archive_storage():
+    """
+    Returns the storage that old entries are archived to.
+    """
+    return get_storage_class(settings.ARCHIVE_STORAGE)()
+
+
+class LRUCache(object):
+    """
+    Thread-safe dict-like store that holds at most ``size`` items,
+    discarding the least recently used item when full.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.items.pop(key)
+            except KeyError:
+                return default
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
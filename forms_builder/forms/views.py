@@ -1,26 +1,178 @@
 from __future__ import unicode_literals
 
 import json
+from hashlib import md5
+from math import ceil
+from os.path import basename
+from time import time
+from uuid import uuid4
 
+from django import VERSION as DJANGO_VERSION
 from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.contrib.sites.models import Site
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
 try:
     from django.urls import reverse
 except ImportError:
     # For Django 1.8 compatibility
     from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseBadRequest
-from django.shortcuts import get_object_or_404, redirect, render_to_response
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.middleware.csrf import get_token
+from django.shortcuts import redirect, render_to_response
 from django.template import RequestContext
 from django.utils.http import urlquote
+from django.utils.translation import get_language, ugettext
 from django.views.generic.base import TemplateView
 from email_extras.utils import send_mail_template
 
-from forms_builder.forms.forms import FormForForm
-from forms_builder.forms.models import Form
-from forms_builder.forms.settings import EMAIL_FAIL_SILENTLY
+from forms_builder.forms.fields import FILE
+from forms_builder.forms.forms import FormForForm, FormSchema, fs
+from forms_builder.forms.forms import SUBMISSION_TOKEN_FIELD
+from forms_builder.forms.metrics import timed
+from forms_builder.forms.models import Form, QueuedEmail
+from forms_builder.forms.settings import CACHE_ALIAS, PAGE_CACHE_TIMEOUT
+from forms_builder.forms.settings import EMAIL_ATTACHMENT_MAX_SIZE
+from forms_builder.forms.settings import EMAIL_FAIL_SILENTLY, EMAIL_OUTBOX
+from forms_builder.forms.settings import IDEMPOTENCY_TIMEOUT
+from forms_builder.forms.settings import THROTTLE_BURST, THROTTLE_BY
+from forms_builder.forms.settings import USE_SITES
 from forms_builder.forms.signals import form_invalid, form_valid
-from forms_builder.forms.utils import split_choices
+from forms_builder.forms.utils import CSRF_TOKEN_MARKER, split_choices
+from forms_builder.forms.utils import SUBMISSION_TOKEN_MARKER
+
+
+# Stored for an idempotency key while its submission is being handled.
+SUBMISSION_PENDING = "pending"
+
+
+def get_published_form(request, slug):
+    """
+    Return the published form for the slug, or raise 404.
+    """
+    try:
+        return Form.objects.get_published(slug, for_user=request.user)
+    except Form.DoesNotExist:
+        raise Http404
+
+
+def page_cache_key(request, form, template):
+    """
+    Returns the key for caching the form's page rendered with the given
+    template, or ``None`` if it can't be cached, when caching isn't
+    enabled, the user isn't anonymous, or the page differs for each
+    request. The key includes the form's version, which changes
+    whenever the form or its fields change.
+    """
+    authenticated = request.user.is_authenticated
+    if DJANGO_VERSION < (1, 10):
+        # Django 1.8 compatibility, is_authenticated has to be called as a method.
+        authenticated = request.user.is_authenticated()
+    if (PAGE_CACHE_TIMEOUT is None or request.method != "GET"
+            or authenticated or form.login_required
+            or FormSchema.for_form(form).templates):
+        return None
+    site_id = Site.objects.get_current().id if USE_SITES else 0
+    page = md5(("%s %s" % (form.slug, template)).encode("utf-8"))
+    return "forms_builder.page.%s.%s.%s.%s" % (site_id, page.hexdigest(),
+        form.version, get_language())
+
+
+def cached_page(request, key, render):
+    """
+    Returns the page cached with the given key, otherwise calling
+    ``render`` to build the response with the CSRF token marker in
+    place of the token, and caching it. The request's CSRF token and
+    a new submission token are then added to the page. Only used for
+    published forms, so pages aren't served once a form's publish
+    window closes.
+    """
+    cache = caches[CACHE_ALIAS]
+    page = cache.get(key)
+    if page is None:
+        response = render()
+        if hasattr(response, "render"):
+            response.render()
+        if response.status_code != 200:
+            return response
+        page = (response.content, response["Content-Type"])
+        cache.set(key, page, PAGE_CACHE_TIMEOUT)
+    content, content_type = page
+    csrf_token = get_token(request).encode("ascii")
+    content = content.replace(CSRF_TOKEN_MARKER.encode("ascii"), csrf_token)
+    content = content.replace(SUBMISSION_TOKEN_MARKER.encode("ascii"),
+                              uuid4().hex.encode("ascii"))
+    return HttpResponse(content, content_type=content_type)
+
+
+def throttle_wait(request, form):
+    """
+    Takes a token from the visitor's bucket for submitting the form,
+    returning ``None`` if there was one, otherwise the number of
+    seconds until there will be. Each bucket holds up to
+    ``settings.THROTTLE_BURST`` tokens, refilled at the form's throttle
+    rate, and is kept in the cache so it's shared between processes.
+    Buckets aren't locked, so a visitor's concurrent submissions can
+    occasionally take the same token.
+    """
+    if not form.throttle_rate:
+        return None
+    ip = request.META.get("REMOTE_ADDR", "")
+    visitor = [ip] if "ip" in THROTTLE_BY else []
+    session = getattr(request, "session", None)
+    if "session" in THROTTLE_BY and getattr(session, "session_key", None):
+        visitor.append(session.session_key)
+    elif not visitor:
+        visitor.append(ip)
+    visitor = md5(" ".join(visitor).encode("utf-8")).hexdigest()
+    key = "forms_builder.throttle.%s.%s" % (form.id, visitor)
+    cache = caches[CACHE_ALIAS]
+    rate = form.throttle_rate / 3600.
+    current = time()
+    tokens, updated = cache.get(key, (THROTTLE_BURST, current))
+    tokens = min(THROTTLE_BURST, tokens + (current - updated) * rate)
+    if tokens < 1:
+        return (1 - tokens) / rate
+    # Expire the bucket once it would be full again.
+    cache.set(key, (tokens - 1, current),
+              int(ceil((THROTTLE_BURST - tokens + 1) / rate)))
+    return None
+
+
+def idempotency_key(request, form):
+    """
+    Returns the cache key for the submission's ``Idempotency-Key``
+    header, or its submission token without one, or ``None`` if there's
+    neither or idempotency keys aren't enabled. Keys are scoped to the
+    form, and should be random enough that they can't be guessed.
+    """
+    if IDEMPOTENCY_TIMEOUT is None:
+        return None
+    key = (request.META.get("HTTP_IDEMPOTENCY_KEY") or
+           request.POST.get(SUBMISSION_TOKEN_FIELD))
+    if not key:
+        return None
+    key = md5(key.encode("utf-8")).hexdigest()
+    return "forms_builder.submission.%s.%s" % (form.id, key)
+
+def submission_digest(request):
+    """
+    Returns a hash of the submission's fields and files, besides its
+    CSRF and submission tokens, to tell whether a submission repeated
+    with the same idempotency key has the same data.
+    """
+    digest = md5()
+    ignored = ("csrfmiddlewaretoken", SUBMISSION_TOKEN_FIELD)
+    for name, values in sorted(request.POST.lists()):
+        if name not in ignored:
+            digest.update(json.dumps([name, values]).encode("utf-8"))
+    for name, files in sorted(request.FILES.lists()):
+        for f in files:
+            digest.update(json.dumps([name, f.name, f.size]).encode("utf-8"))
+            for chunk in f.chunks():
+                digest.update(chunk)
+    return digest.hexdigest()
 
 
 class FormDetail(TemplateView):
@@ -29,8 +181,7 @@ class FormDetail(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super(FormDetail, self).get_context_data(**kwargs)
-        published = Form.objects.published(for_user=self.request.user)
-        context["form"] = get_object_or_404(published, slug=kwargs["slug"])
+        context["form"] = get_published_form(self.request, kwargs["slug"])
         return context
 
     def get(self, request, *args, **kwargs):
@@ -40,32 +191,131 @@ class FormDetail(TemplateView):
             path = urlquote(request.get_full_path())
             bits = (settings.LOGIN_URL, REDIRECT_FIELD_NAME, path)
             return redirect("%s?%s=%s" % bits)
-        return self.render_to_response(context)
+        key = page_cache_key(request, context["form"], self.template_name)
+        if key is None:
+            return self.render_to_response(context)
+        context["csrf_token"] = CSRF_TOKEN_MARKER
+        return cached_page(request, key,
+                           lambda: self.render_to_response(context))
 
     def post(self, request, *args, **kwargs):
-        published = Form.objects.published(for_user=request.user)
-        form = get_object_or_404(published, slug=kwargs["slug"])
-        form_for_form = FormForForm(form, RequestContext(request),
-                                    request.POST or None,
-                                    request.FILES or None)
-        if not form_for_form.is_valid():
+        form = get_published_form(request, kwargs["slug"])
+        key = idempotency_key(request, form)
+        cache = caches[CACHE_ALIAS]
+        if key is not None:
+            digest = submission_digest(request)
+            stored = cache.get(key)
+            if stored is not None:
+                return self.replayed(stored, digest)
+        wait = throttle_wait(request, form)
+        if wait is not None:
+            return self.throttled(wait)
+        if key is None:
+            return self.submit(request, form)
+        # Claim the key, in case the same submission is being handled
+        # by another request at once.
+        if not cache.add(key, (digest, SUBMISSION_PENDING),
+                         IDEMPOTENCY_TIMEOUT):
+            # The key may have been released again in the meantime, in
+            # which case the client can retry it.
+            stored = cache.get(key) or (digest, SUBMISSION_PENDING)
+            return self.replayed(stored, digest)
+        self.entry = None
+        try:
+            response = self.submit(request, form)
+        except Exception:
+            cache.delete(key)
+            raise
+        if self.entry is None:
+            # Nothing was saved, so the submission can be corrected and
+            # sent again with the same key.
+            cache.delete(key)
+            return response
+        if hasattr(response, "render"):
+            response.render()
+        headers = list(response.items())
+        cache.set(key, (digest, (response.status_code, response.content,
+                                 headers)), IDEMPOTENCY_TIMEOUT)
+        return response
+
+    def submit(self, request, form):
+        """
+        Validates and saves the submission, sending its emails.
+        """
+        with timed("build", form.id):
+            form_for_form = FormForForm(form, RequestContext(request),
+                                        request.POST or None,
+                                        request.FILES or None)
+        entry = None
+        with timed("validate", form.id):
+            valid = form_for_form.is_valid()
+        if valid:
+            try:
+                with timed("save", form.id):
+                    entry = self.entry = form_for_form.save()
+            except ValidationError as e:
+                # The form received its last entry in the meantime.
+                form_for_form.add_error(None, e)
+        if entry is None:
             form_invalid.send(sender=request, form=form_for_form)
         else:
-            # Attachments read must occur before model save,
-            # or seek() will fail on large uploads.
-            attachments = []
-            for f in form_for_form.files.values():
-                f.seek(0)
-                attachments.append((f.name, f.read()))
-            entry = form_for_form.save()
-            form_valid.send(sender=request, form=form_for_form, entry=entry)
-            self.send_emails(request, form_for_form, form, entry, attachments)
+            with timed("form_valid", form.id):
+                form_valid.send(sender=request, form=form_for_form,
+                                entry=entry)
+            with timed("send_emails", form.id):
+                self.send_emails(request, form_for_form, form, entry)
             if not self.request.is_ajax():
                 return redirect(form.redirect_url or
                     reverse("form_sent", kwargs={"slug": form.slug}))
         context = {"form": form, "form_for_form": form_for_form}
         return self.render_to_response(context)
 
+    def replayed(self, stored, digest):
+        """
+        Returns the response stored for a submission with the same
+        idempotency key, or a conflict response while the first
+        submission is still being handled. Submissions reusing the key
+        with different data are refused rather than given the first
+        submission's response.
+        """
+        stored_digest, stored = stored
+        if stored_digest != digest:
+            return self.refused(422, ugettext("This submission token was "
+                                "already used for a different submission."))
+        if stored == SUBMISSION_PENDING:
+            return self.refused(409, ugettext("This submission is already "
+                                              "being handled."), 1)
+        status_code, content, headers = stored
+        response = HttpResponse(content, status=status_code)
+        for name, value in headers:
+            response[name] = value
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    def throttled(self, wait):
+        """
+        Returns the response for a submission refused by the form's
+        throttle rate, giving the seconds to wait before trying again.
+        """
+        return self.refused(429, ugettext("Too many submissions, please "
+                                          "try again later."), wait)
+
+    def refused(self, status_code, message, wait=None):
+        """
+        Returns an error response with the given message, as JSON for
+        AJAX submissions, and the seconds to wait before trying again
+        if given.
+        """
+        if self.request.is_ajax():
+            response = HttpResponse(json.dumps({"errors": {"__all__":
+                [message]}}), content_type="application/json")
+        else:
+            response = HttpResponse(message, content_type="text/plain")
+        response.status_code = status_code
+        if wait is not None:
+            response["Retry-After"] = int(ceil(wait))
+        return response
+
     def render_to_response(self, context, **kwargs):
         if self.request.method == "POST" and self.request.is_ajax():
             json_context = json.dumps({
@@ -79,16 +329,45 @@ class FormDetail(TemplateView):
             return HttpResponse(json_context, content_type="application/json")
         return super(FormDetail, self).render_to_response(context, **kwargs)
 
-    def send_emails(self, request, form_for_form, form, entry, attachments):
+    def get_attachments(self, request, form_for_form, entry):
+        """
+        Returns the names of the files uploaded for the entry to attach
+        to emails, and a dict of admin download links, keyed by field
+        slug, for files over ``settings.EMAIL_ATTACHMENT_MAX_SIZE``.
+        The saved files are referred to rather than read here, and are
+        only read when each email is built.
+        """
+        attachments = []
+        links = {}
+        file_fields = dict([(f.id, f) for f in form_for_form.form_fields
+                            if f.is_a(FILE)])
+        if not file_fields:
+            return attachments, links
+        field_entries = entry.fields.filter(field_id__in=file_fields.keys())
+        for field_entry in field_entries:
+            if not field_entry.value:
+                continue
+            if (EMAIL_ATTACHMENT_MAX_SIZE is not None and
+                    fs.size(field_entry.value) > EMAIL_ATTACHMENT_MAX_SIZE):
+                url = reverse("admin:form_file", args=(field_entry.id,))
+                slug = file_fields[field_entry.field_id].slug
+                links[slug] = request.build_absolute_uri(url)
+            else:
+                attachments.append(field_entry.value)
+        return attachments, links
+
+    def send_emails(self, request, form_for_form, form, entry):
         subject = form.email_subject
         if not subject:
             subject = "%s - %s" % (form.title, entry.entry_time)
+        attachments, links = self.get_attachments(request, form_for_form,
+                                                  entry)
         fields = []
         for (k, v) in form_for_form.fields.items():
             value = form_for_form.cleaned_data[k]
             if isinstance(value, list):
                 value = ", ".join([i.strip() for i in value])
-            fields.append((v.label, value))
+            fields.append((v.label, links.get(k, value)))
         context = {
             "fields": fields,
             "message": form.email_message,
@@ -96,20 +375,30 @@ class FormDetail(TemplateView):
         }
         email_from = form.email_from or settings.DEFAULT_FROM_EMAIL
         email_to = form_for_form.email_to()
+        if EMAIL_OUTBOX:
+            # Queue the emails for the send_queued_emails command, which
+            # reads the attachments from storage when sending.
+            send_kwargs = {}
+            send = QueuedEmail.objects.queue_mail_template
+        else:
+            send_kwargs = {"fail_silently": EMAIL_FAIL_SILENTLY}
+            send = send_mail_template
+            # The files are read from storage only now, as the emails
+            # are built.
+            for i, name in enumerate(attachments):
+                with fs.open(name) as f:
+                    attachments[i] = (basename(name), f.read())
         if email_to and form.send_email:
-            send_mail_template(subject, "form_response", email_from,
-                               email_to, context=context,
-                               fail_silently=EMAIL_FAIL_SILENTLY)
+            send(subject, "form_response", email_from, email_to,
+                 context=context, **send_kwargs)
         headers = None
         if email_to:
             headers = {"Reply-To": email_to}
         email_copies = split_choices(form.email_copies)
         if email_copies:
-            send_mail_template(subject, "form_response_copies", email_from,
-                               email_copies, context=context,
-                               attachments=attachments,
-                               fail_silently=EMAIL_FAIL_SILENTLY,
-                               headers=headers)
+            send(subject, "form_response_copies", email_from, email_copies,
+                 context=context, attachments=attachments, headers=headers,
+                 **send_kwargs)
 
 form_detail = FormDetail.as_view()
 
@@ -118,6 +407,12 @@ def form_sent(request, slug, template="forms/form_sent.html"):
     """
     Show the response message.
     """
-    published = Form.objects.published(for_user=request.user)
-    context = {"form": get_object_or_404(published, slug=slug)}
-    return render_to_response(template, context, RequestContext(request))
+    form = get_published_form(request, slug)
+    context = {"form": form}
+    render = lambda: render_to_response(template, context,
+                                        RequestContext(request))
+    key = page_cache_key(request, form, template)
+    if key is None:
+        return render()
+    context["csrf_token"] = CSRF_TOKEN_MARKER
+    return cached_page(request, key, render)